@@ -0,0 +1,453 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'mapred-lab3'))
+import MapReduce
+
+"""
+Implementations of the lab applications used by the benchmarks. Every job
+follows the algorithm described in the lab source file of the same name and
+reads the data sets written by generateData.py.
+"""
+
+mr = MapReduce.MapReduce()
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Application Usage:
+#
+#   python benchmarkJobs.py arg-1 arg-2 arg-3 [arg-4]
+#
+#   arg-1 : Name of the job (one of the names in JOBS).
+#   arg-2 : Directory containing the data sets.
+#   arg-3 : File the job statistics are written to as JSON.
+#   arg-4 : Optional JSON object with extra arguments for execute()
+#           (for ex: '{"workers": 4}').
+#
+# The output of the job is discarded.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+# Column names of the CSV tables and other data that the mappers need. They
+# are set before execute() is called.
+commonWords = set()
+postsColumns = {}
+usersColumns = {}
+matrixSize = 0
+
+def read_columns(fileName):
+    header = open(fileName).readline().rstrip('\r\n')
+    return dict((name, index) for index, name in
+                enumerate(header.split(',')))
+
+# WordCount (mapred-lab1)
+def wordcount_mapper(key, record):
+    for word in record.split():
+        if word not in commonWords:
+            mr.emit_intermediate(word, 1)
+
+def wordcount_reducer(key, list_of_values):
+    mr.emit((key, len(list_of_values)))
+
+# MatrixMultiply (mapred-lab1)
+def matrix_mapper(key, record):
+    matrixName, i, j = record[0], int(record[1]), int(record[2])
+    if (matrixName == 'A'):
+        for k in range(matrixSize):
+            mr.emit_intermediate((i, k), record)
+    else:
+        for k in range(matrixSize):
+            mr.emit_intermediate((k, j), record)
+
+def matrix_reducer(key, list_of_values):
+    rowOfA = {}
+    columnOfB = {}
+    for cell in list_of_values:
+        if (cell[0] == 'A'):
+            rowOfA[cell[2]] = int(cell[3])
+        else:
+            columnOfB[cell[1]] = int(cell[3])
+    total = 0
+    for j in rowOfA:
+        total += rowOfA[j] * columnOfB.get(j, 0)
+    mr.emit((key[0], key[1], total))
+
+# SQLSelect (mapred-lab2)
+def select_mapper(key, record):
+    answerCount = record[postsColumns['AnswerCount']]
+    if answerCount:
+        value = (record[postsColumns['Title']],
+                 record[postsColumns['Score']],
+                 record[postsColumns['ViewCount']],
+                 record[postsColumns['CommentsCount']])
+        mr.emit_intermediate(answerCount, value)
+
+def select_reducer(key, list_of_values):
+    if (key == '0'):
+        for value in list_of_values:
+            mr.emit((key, value))
+
+# SQLGroupBy (mapred-lab2)
+def groupby_mapper(key, record):
+    if (record[postsColumns['PostTypeId']] != '1'):
+        return
+    lenTitle = len(record[postsColumns['Title']])
+    if (lenTitle == 0):
+        return
+    if (lenTitle <= 10):
+        titleRange = '1_10'
+    elif (lenTitle <= 20):
+        titleRange = '11_20'
+    elif (lenTitle <= 30):
+        titleRange = '21_30'
+    else:
+        titleRange = '30+'
+    mr.emit_intermediate(titleRange, 1)
+
+def groupby_reducer(key, list_of_values):
+    mr.emit(key + '->' + str(len(list_of_values)))
+
+# SQLJoin (mapred-lab2)
+def join_mapper(key, record):
+    if (record[0] == 'USERS'):
+        mr.emit_intermediate(record[usersColumns['Id']], record)
+    elif (record[postsColumns['PostTypeId']] == '1'):
+        mr.emit_intermediate(record[postsColumns['OwnerUserId']], record)
+
+def join_reducer(key, list_of_values):
+    user = None
+    posts = []
+    for record in list_of_values:
+        if (record[0] == 'USERS'):
+            user = record
+        else:
+            posts.append(record)
+    if (user is None or not posts):
+        return
+    reputation = user[usersColumns['Reputation']]
+    if (int(reputation) < 500):
+        return
+    for post in posts:
+        mr.emit(','.join([key, user[usersColumns['DisplayName']], reputation,
+                          post[postsColumns['Title']],
+                          post[postsColumns['AnswerCount']], '']))
+
+# DuplicateImages (mapred-lab2)
+def images_mapper(key, record):
+    fileName, imageData = record
+    mr.emit_intermediate(str(imageData), fileName)
+
+def images_reducer(key, list_of_values):
+    if (len(list_of_values) > 1):
+        mr.emit(','.join(list_of_values) + ',')
+
+# recommendBooks (mapred-lab3)
+def books_mapper(key, record):
+    mainBook = record[0]
+    for reco in record[1:]:
+        if (mainBook < reco):
+            mr.emit_intermediate((mainBook, reco), record)
+        else:
+            mr.emit_intermediate((reco, mainBook), record)
+
+def books_reducer(key, list_of_values):
+    bookA, bookB = key
+    recosForA = []
+    recosForB = []
+    for item in list_of_values:
+        if (item[0] == bookA):
+            recosForA = item
+        else:
+            recosForB = item
+    newRecosForA = [bookA] + [book for book in recosForB
+                              if book not in recosForA]
+    newRecosForB = [bookB] + [book for book in recosForA
+                              if book not in recosForB]
+    if (len(newRecosForA) > 1):
+        mr.emit(newRecosForA)
+    if (len(newRecosForB) > 1):
+        mr.emit(newRecosForB)
+
+# Generator versions of the jobs with the most intermediate pairs. They
+# yield their pairs and results instead of calling mr.emit_intermediate and
+# mr.emit, and are run as the jobs named '<job>/gen'.
+def wordcount_gen_mapper(key, record):
+    for word in record.split():
+        if word not in commonWords:
+            yield (word, 1)
+
+def wordcount_gen_reducer(key, list_of_values):
+    yield (key, len(list_of_values))
+
+def matrix_gen_mapper(key, record):
+    matrixName, i, j = record[0], int(record[1]), int(record[2])
+    if (matrixName == 'A'):
+        for k in range(matrixSize):
+            yield ((i, k), record)
+    else:
+        for k in range(matrixSize):
+            yield ((k, j), record)
+
+def matrix_gen_reducer(key, list_of_values):
+    rowOfA = {}
+    columnOfB = {}
+    for cell in list_of_values:
+        if (cell[0] == 'A'):
+            rowOfA[cell[2]] = int(cell[3])
+        else:
+            columnOfB[cell[1]] = int(cell[3])
+    total = 0
+    for j in rowOfA:
+        total += rowOfA[j] * columnOfB.get(j, 0)
+    yield (key[0], key[1], total)
+
+def books_gen_mapper(key, record):
+    mainBook = record[0]
+    for reco in record[1:]:
+        if (mainBook < reco):
+            yield ((mainBook, reco), record)
+        else:
+            yield ((reco, mainBook), record)
+
+def books_gen_reducer(key, list_of_values):
+    bookA, bookB = key
+    recosForA = []
+    recosForB = []
+    for item in list_of_values:
+        if (item[0] == bookA):
+            recosForA = item
+        else:
+            recosForB = item
+    newRecosForA = [bookA] + [book for book in recosForB
+                              if book not in recosForA]
+    newRecosForB = [bookB] + [book for book in recosForA
+                              if book not in recosForB]
+    if (len(newRecosForA) > 1):
+        yield newRecosForA
+    if (len(newRecosForB) > 1):
+        yield newRecosForB
+
+# Versions of the SQL jobs that read only the columns they use with the
+# CSV-Header format, run as the jobs named '<job>/cols'.
+SELECT_COLUMNS = ['AnswerCount', 'Title', 'Score', 'ViewCount',
+                  'CommentsCount']
+GROUPBY_COLUMNS = ['PostTypeId', 'Title']
+JOIN_USERS_COLUMNS = ['TableName', 'Id', 'DisplayName', 'Reputation']
+JOIN_POSTS_COLUMNS = ['TableName', 'OwnerUserId', 'PostTypeId', 'Title',
+                      'AnswerCount']
+
+def select_cols_mapper(key, record):
+    answerCount = record.AnswerCount
+    if answerCount:
+        mr.emit_intermediate(answerCount, (record.Title, record.Score,
+                                           record.ViewCount,
+                                           record.CommentsCount))
+
+def groupby_cols_mapper(key, record):
+    if (record.PostTypeId != '1'):
+        return
+    lenTitle = len(record.Title)
+    if (lenTitle == 0):
+        return
+    if (lenTitle <= 10):
+        titleRange = '1_10'
+    elif (lenTitle <= 20):
+        titleRange = '11_20'
+    elif (lenTitle <= 30):
+        titleRange = '21_30'
+    else:
+        titleRange = '30+'
+    mr.emit_intermediate(titleRange, 1)
+
+def join_cols_mapper(key, record):
+    if (record.TableName == 'USERS'):
+        mr.emit_intermediate(record.Id, record)
+    elif (record.PostTypeId == '1'):
+        mr.emit_intermediate(record.OwnerUserId, record)
+
+def join_cols_reducer(key, list_of_values):
+    user = None
+    posts = []
+    for record in list_of_values:
+        if (record.TableName == 'USERS'):
+            user = record
+        else:
+            posts.append(record)
+    if (user is None or not posts):
+        return
+    if (int(user.Reputation) < 500):
+        return
+    for post in posts:
+        mr.emit(','.join([key, user.DisplayName, user.Reputation, post.Title,
+                          post.AnswerCount, '']))
+
+# Version of SQLJoin that reads the StackExchange dumps (SOXML) instead of
+# the CSV tables, run as the job named 'SQLJoin/xml'. Every record is the
+# dictionary of the attributes of a row, and the table of a row is told by
+# the name of its file, which is the key passed to the mapper. Missing
+# attributes are read as empty strings, like XmlToCsv.py writes them.
+def join_xml_mapper(key, record):
+    if (os.path.basename(key) == 'Users.xml'):
+        mr.emit_intermediate(record.get('Id', ''),
+                             ('USERS', record.get('DisplayName', ''),
+                              record.get('Reputation', '')))
+    elif (record.get('PostTypeId') == '1'):
+        mr.emit_intermediate(record.get('OwnerUserId', ''),
+                             ('POSTS', record.get('Title', ''),
+                              record.get('AnswerCount', '')))
+
+def join_xml_reducer(key, list_of_values):
+    user = None
+    posts = []
+    for record in list_of_values:
+        if (record[0] == 'USERS'):
+            user = record
+        else:
+            posts.append(record)
+    if (user is None or not posts):
+        return
+    tableName, displayName, reputation = user
+    if (int(reputation) < 500):
+        return
+    for tableName, title, answerCount in posts:
+        mr.emit(','.join([key, displayName, reputation, title, answerCount,
+                          '']))
+
+# Versions of the '/cols' jobs whose WHERE clause is a filter applied by the
+# reader, run as the jobs named '<job>/where'.
+SELECT_WHERE = ('AnswerCount', '==', '0')
+JOIN_USERS_WHERE = ('Reputation', '>=', 500)
+JOIN_POSTS_WHERE = ('PostTypeId', '==', '1')
+
+def _data(dataDir, fileName):
+    return os.path.join(dataDir, fileName)
+
+def run_wordcount(dataDir, options, mapper=wordcount_mapper,
+                  reducer=wordcount_reducer):
+    commonWords.update(open(_data(dataDir, 'commonWords.txt')).read().split())
+    return mr.execute([_data(dataDir, 'discourse.txt')], mapper, reducer,
+                      'TEXT', **options)
+
+def run_matrixmultiply(dataDir, options, mapper=matrix_mapper,
+                       reducer=matrix_reducer):
+    global matrixSize
+    matrixFile = _data(dataDir, 'matrix.csv')
+    matrixSize = max(int(line.split(',')[1])
+                     for line in open(matrixFile)) + 1
+    return mr.execute([matrixFile], mapper, reducer, 'CSV', **options)
+
+def run_sqlselect(dataDir, options):
+    postsColumns.update(read_columns(_data(dataDir, 'Posts.csv')))
+    return mr.execute([_data(dataDir, 'Posts.csv')], select_mapper,
+                      select_reducer, 'CSV-SkipFirstLine', **options)
+
+def run_sqlgroupby(dataDir, options):
+    postsColumns.update(read_columns(_data(dataDir, 'Posts.csv')))
+    return mr.execute([_data(dataDir, 'Posts.csv')], groupby_mapper,
+                      groupby_reducer, 'CSV-SkipFirstLine', **options)
+
+def run_sqljoin(dataDir, options):
+    usersColumns.update(read_columns(_data(dataDir, 'Users.csv')))
+    postsColumns.update(read_columns(_data(dataDir, 'Posts.csv')))
+    return mr.execute([_data(dataDir, 'Users.csv'),
+                       _data(dataDir, 'Posts.csv')],
+                      join_mapper, join_reducer, 'CSV-SkipFirstLine',
+                      **options)
+
+def run_duplicateimages(dataDir, options):
+    imageList = _data(dataDir, 'imageList.txt')
+    if not os.path.exists(imageList):
+        return None
+    fileNameList = [line.strip() for line in open(imageList)]
+    return mr.execute(fileNameList, images_mapper, images_reducer, 'IMAGE',
+                      **options)
+
+def run_recommendbooks(dataDir, options, mapper=books_mapper,
+                       reducer=books_reducer):
+    return mr.execute([_data(dataDir, 'bookBuddies.csv')], mapper, reducer,
+                      'CSV', **options)
+
+def run_wordcount_gen(dataDir, options):
+    return run_wordcount(dataDir, options, wordcount_gen_mapper,
+                         wordcount_gen_reducer)
+
+def run_matrixmultiply_gen(dataDir, options):
+    return run_matrixmultiply(dataDir, options, matrix_gen_mapper,
+                              matrix_gen_reducer)
+
+def run_recommendbooks_gen(dataDir, options):
+    return run_recommendbooks(dataDir, options, books_gen_mapper,
+                              books_gen_reducer)
+
+def run_sqlselect_cols(dataDir, options):
+    return mr.execute([_data(dataDir, 'Posts.csv')], select_cols_mapper,
+                      select_reducer, 'CSV-Header', columns=SELECT_COLUMNS,
+                      **options)
+
+def run_sqlgroupby_cols(dataDir, options):
+    return mr.execute([_data(dataDir, 'Posts.csv')], groupby_cols_mapper,
+                      groupby_reducer, 'CSV-Header', columns=GROUPBY_COLUMNS,
+                      **options)
+
+def run_sqljoin_cols(dataDir, options):
+    usersFile = _data(dataDir, 'Users.csv')
+    postsFile = _data(dataDir, 'Posts.csv')
+    columns = {usersFile: JOIN_USERS_COLUMNS, postsFile: JOIN_POSTS_COLUMNS}
+    return mr.execute([usersFile, postsFile], join_cols_mapper,
+                      join_cols_reducer, 'CSV-Header', columns=columns,
+                      **options)
+
+def run_sqlselect_where(dataDir, options):
+    return mr.execute([_data(dataDir, 'Posts.csv')], select_cols_mapper,
+                      select_reducer, 'CSV-Header', columns=SELECT_COLUMNS,
+                      where=SELECT_WHERE, **options)
+
+def run_sqljoin_where(dataDir, options):
+    usersFile = _data(dataDir, 'Users.csv')
+    postsFile = _data(dataDir, 'Posts.csv')
+    columns = {usersFile: JOIN_USERS_COLUMNS, postsFile: JOIN_POSTS_COLUMNS}
+    where = {usersFile: JOIN_USERS_WHERE, postsFile: JOIN_POSTS_WHERE}
+    return mr.execute([usersFile, postsFile], join_cols_mapper,
+                      join_cols_reducer, 'CSV-Header', columns=columns,
+                      where=where, **options)
+
+def run_sqljoin_xml(dataDir, options):
+    return mr.execute([_data(dataDir, 'Users.xml'),
+                       _data(dataDir, 'Posts.xml')],
+                      join_xml_mapper, join_xml_reducer, 'SOXML', **options)
+
+JOBS = [
+    ('WordCount', run_wordcount, ['discourse.txt']),
+    ('MatrixMultiply', run_matrixmultiply, ['matrix.csv']),
+    ('SQLSelect', run_sqlselect, ['Posts.csv']),
+    ('SQLGroupBy', run_sqlgroupby, ['Posts.csv']),
+    ('SQLJoin', run_sqljoin, ['Users.csv', 'Posts.csv']),
+    ('DuplicateImages', run_duplicateimages, ['images']),
+    ('recommendBooks', run_recommendbooks, ['bookBuddies.csv']),
+    ('WordCount/gen', run_wordcount_gen, ['discourse.txt']),
+    ('MatrixMultiply/gen', run_matrixmultiply_gen, ['matrix.csv']),
+    ('recommendBooks/gen', run_recommendbooks_gen, ['bookBuddies.csv']),
+    ('SQLSelect/cols', run_sqlselect_cols, ['Posts.csv']),
+    ('SQLGroupBy/cols', run_sqlgroupby_cols, ['Posts.csv']),
+    ('SQLJoin/cols', run_sqljoin_cols, ['Users.csv', 'Posts.csv']),
+    ('SQLSelect/where', run_sqlselect_where, ['Posts.csv']),
+    ('SQLJoin/where', run_sqljoin_where, ['Users.csv', 'Posts.csv']),
+    ('SQLJoin/xml', run_sqljoin_xml, ['Users.xml', 'Posts.xml']),
+]
+
+def main():
+    jobName, dataDir, statsFile = sys.argv[1:4]
+    options = {}
+    if (len(sys.argv) > 4):
+        options = dict((str(name), value) for name, value in
+                       json.loads(sys.argv[4]).items())
+    options['output'] = os.devnull
+    options['stats_file'] = statsFile
+    for name, run, inputs in JOBS:
+        if (name == jobName):
+            run(dataDir, options)
+            return
+    raise ValueError('Unknown job: %s' % jobName)
+
+if __name__ == '__main__':
+    main()
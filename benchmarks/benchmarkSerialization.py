@@ -0,0 +1,144 @@
+import os
+import gc
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+
+import benchmarkJobs
+from runBenchmarks import BENCHMARK_DIR, data_dir
+
+MapReduce = benchmarkJobs.MapReduce
+
+"""
+Compares the serializers of MapReduce.py on the intermediate data of the lab
+applications: the time to encode and decode it, and its size.
+"""
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Application Usage:
+#
+#   python benchmarkSerialization.py [--scale 10] [--jobs WordCount,SQLJoin]
+#                                    [--data-dir DIR] [--repeat 3]
+#
+#   --scale    : Scale factor of the data set (see generateData.py).
+#   --jobs     : Jobs whose intermediate data is used. Defaults to the jobs
+#                in JOBS.
+#   --data-dir : Directory for the data sets (see runBenchmarks.py).
+#   --repeat   : Number of times every measure is taken. The best time is
+#                reported.
+#
+# The intermediate data of a job is the map output that the job stores in a
+# cache directory: one buffer per map task, as the workers return them. Two
+# forms of it are measured for every serializer:
+#   buffers - the buffers, one frame each, as they are sent by the workers
+#             and stored in the cache.
+#   run     - the buffers merged, written to a run file and read back, as
+#             when the intermediate data is spilled.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+# Jobs with the shapes of the lab data: string keys and counts (WordCount),
+# (i, j) keys and CSV records shared by many keys (MatrixMultiply), tuples
+# of ISBNs (recommendBooks) and whole CSV records (SQLJoin).
+JOBS = ['WordCount', 'MatrixMultiply', 'recommendBooks', 'SQLJoin',
+        'SQLSelect/cols']
+
+# The buffers of intermediate data of a job.
+def map_output(jobName, directory):
+    cacheDir = tempfile.mkdtemp(prefix='mapred-')
+    try:
+        for name, run, inputs in benchmarkJobs.JOBS:
+            if (name == jobName):
+                run(directory, {'output': os.devnull, 'cache_dir': cacheDir,
+                                'serializer': 'pickle'})
+                break
+        else:
+            raise ValueError('Unknown job: %s' % jobName)
+        buffers = []
+        for entryPath in sorted(glob.glob(os.path.join(cacheDir, '*.map'))):
+            buffers.extend(MapReduce.MapOutputCache(cacheDir, '')
+                           .read_entry(entryPath))
+        return buffers
+    finally:
+        shutil.rmtree(cacheDir, True)
+
+def best_time(function, repeat):
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            result = function()
+            seconds = time.time() - start
+        finally:
+            gc.enable()
+        if (best is None or seconds < best):
+            best = seconds
+    return best, result
+
+def measure_buffers(buffers, serializer, repeat):
+    def encode():
+        encoder = MapReduce.FrameEncoder(serializer)
+        return encoder.encode_all(buffers)
+    def decode():
+        return list(MapReduce.decode_frames(data))
+    encodeSeconds, data = best_time(encode, repeat)
+    decodeSeconds, decoded = best_time(decode, repeat)
+    assert decoded == buffers
+    return len(data), encodeSeconds, decodeSeconds
+
+def measure_run(intermediate, serializer, repeat):
+    paths = []
+    def write():
+        path, segments = MapReduce._write_run(intermediate, 1,
+                                              MapReduce.default_partitioner,
+                                              None, serializer)
+        paths.append(path)
+        return path, segments
+    def read():
+        return sum(1 for record in MapReduce._read_segment(0, path,
+                                                           *segments[0]))
+    try:
+        encodeSeconds, (path, segments) = best_time(write, repeat)
+        decodeSeconds, records = best_time(read, repeat)
+        return os.path.getsize(path), encodeSeconds, decodeSeconds
+    finally:
+        for path in paths:
+            os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=10)
+    parser.add_argument('--jobs', default=None)
+    parser.add_argument('--data-dir', default=os.path.join(BENCHMARK_DIR,
+                                                           'data'))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    jobNames = JOBS
+    if args.jobs:
+        jobNames = args.jobs.split(',')
+    directory = data_dir(args.data_dir, args.scale)
+
+    print '%-16s %-7s %-7s %9s %9s %9s %9s %9s' % (
+        'job', 'data', 'format', 'keys', 'values', 'MB', 'encode s',
+        'decode s')
+    for jobName in jobNames:
+        buffers = map_output(jobName, directory)
+        intermediate = MapReduce._merge_partitions(buffers)
+        numValues = sum(len(values) for values in intermediate.itervalues())
+        for form, data, measure in (('buffers', buffers, measure_buffers),
+                                    ('run', intermediate, measure_run)):
+            for serializer in ('pickle', 'binary', 'auto'):
+                size, encodeSeconds, decodeSeconds = measure(data, serializer,
+                                                             args.repeat)
+                print '%-16s %-7s %-7s %9d %9d %9.2f %9.3f %9.3f' % (
+                    jobName, form, serializer, len(intermediate), numValues,
+                    size / 1048576.0, encodeSeconds, decodeSeconds)
+                sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
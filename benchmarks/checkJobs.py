@@ -0,0 +1,282 @@
+import os
+import sys
+import array
+import shutil
+import argparse
+import tempfile
+
+import benchmarkJobs
+from runBenchmarks import BENCHMARK_DIR, data_dir
+
+MapReduce = benchmarkJobs.MapReduce
+
+"""
+Checks that the options of MapReduce.execute() do not change the results of
+the lab applications: every job is run serially, and then with every
+variant in VARIANTS, and the results must be the same. The jobs of
+ERROR_JOBS must fail with the same error with every variant.
+"""
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Application Usage:
+#
+#   python checkJobs.py [--jobs WordCount,SQLJoin] [--variants workers,spill]
+#                       [--scale N] [--data-dir DIR]
+#
+#   --jobs     : Jobs to check. Defaults to all the jobs in
+#                benchmarkJobs.JOBS and CHECK_JOBS.
+#   --variants : Variants to check. Defaults to all the variants in VARIANTS.
+#   --scale    : Check on the generated data sets of this scale (see
+#                runBenchmarks.py) instead of the samples in the datasets
+#                directory.
+#   --data-dir : Directory for the generated data sets.
+#
+# The results of a job are compared as the sorted repr() of the items it
+# writes, so that a value that comes back with another type is a
+# difference. The exit status is 1 when a job gave different results.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+DATASETS_DIR = os.path.join(BENCHMARK_DIR, '..', 'datasets')
+
+# Data sets of benchmarkJobs.py made of the samples in the datasets
+# directory, by file name. A file made of several samples is their
+# concatenation.
+SAMPLES = {
+    'discourse.txt': ['Swami_discourse/DD_Nov_21_2000.txt',
+                      'Swami_discourse/DD_Nov_23_2000.txt'],
+    'commonWords.txt': ['Swami_discourse/commonWords.txt'],
+    'matrix.csv': ['matrix_multiply/matrix9x9x2.csv'],
+    'Posts.csv': ['cstheory_sample/Posts_Sample.csv'],
+    'Users.csv': ['cstheory_sample/Users_Sample.csv'],
+    'Posts.xml': ['cstheory_sample/Posts_Sample.xml'],
+    'Users.xml': ['cstheory_sample/Users_Sample.xml'],
+    'bookBuddies.csv': ['library_sample/recommendationsSample.csv'],
+}
+
+# The samples are small: the data is spilled and split into chunks after
+# this many pairs and values, and a key is hot from this many values,
+# instead of the defaults.
+BUFFER_PAIRS = 10
+RUN_CHUNK_VALUES = 10
+HOT_KEY_MIN_VALUES = 10
+
+# Extra arguments for execute() of every variant. A split size of 256
+# bytes splits every sample into several map tasks.
+VARIANTS = [
+    ('workers', {'workers': 2}),
+    ('splits', {'workers': 3, 'split_size': 256}),
+    ('partitions', {'workers': 2, 'partitions': 5}),
+    ('spill', {'memory_limit': 1}),
+    ('spill/workers', {'workers': 2, 'memory_limit': 1, 'split_size': 256}),
+    ('compact', {'compact': True}),
+    ('compact/spill', {'compact': True, 'memory_limit': 1}),
+    ('mmap', {'use_mmap': True, 'workers': 2, 'split_size': 256}),
+    ('prefetch', {'prefetch': 2}),
+    ('retries', {'workers': 2, 'retries': 1, 'split_size': 256}),
+    ('speculative', {'workers': 3, 'split_size': 256, 'speculative': True}),
+    ('binary', {'workers': 2, 'memory_limit': 1, 'split_size': 256,
+                'serializer': 'binary'}),
+    ('pickle', {'workers': 2, 'memory_limit': 1, 'split_size': 256,
+                'serializer': 'pickle'}),
+    ('cache', {'cache_dir': None}),
+    ('cache/workers', {'cache_dir': None, 'workers': 2, 'split_size': 256}),
+]
+
+# A job whose values are of types that the serializers must keep: objects
+# with a buffer, which marshal writes as str, and a subclass of str.
+class Word(str):
+    def __repr__(self):
+        return 'Word(%s)' % str.__repr__(self)
+
+def types_mapper(key, record):
+    for word in record.split():
+        yield (word[:1], (Word(word), array.array('c', word),
+                          bytearray(word), buffer(word)[:]))
+
+def types_reducer(key, list_of_values):
+    yield (key, [repr(value) for value in list_of_values])
+
+def run_types(dataDir, options):
+    return MapReduce.execute([os.path.join(dataDir, 'discourse.txt')],
+                             types_mapper, types_reducer, 'TEXT', **options)
+
+# Jobs whose keys are the first letters of the words: a few keys hold most
+# of the values and are salted with workers > 1, by the combiner or by the
+# associative reducer.
+def letters_mapper(key, record):
+    for word in record.split():
+        yield (word[:1].lower(), 1)
+
+def letters_reducer(key, list_of_values):
+    yield (key, sum(list_of_values))
+
+def letters_combiner(key, list_of_values):
+    return [sum(list_of_values)]
+
+def run_letters(dataDir, options):
+    return salted(MapReduce.execute([os.path.join(dataDir, 'discourse.txt')],
+                                    letters_mapper, letters_reducer, 'TEXT',
+                                    combiner=letters_combiner, **options),
+                  options)
+
+def run_letters_associative(dataDir, options):
+    return salted(MapReduce.execute([os.path.join(dataDir, 'discourse.txt')],
+                                    letters_mapper, letters_reducer, 'TEXT',
+                                    associative=True, **options),
+                  options)
+
+# The results of the HotKeys jobs are only those of a salted job, to be
+# compared with the serial ones, if the hot keys were salted. They are with
+# workers, unless the data is spilled or read from the cache.
+def salted(stats, options):
+    if (options.get('workers', 1) > 1 and 'memory_limit' not in options and
+        'cache_dir' not in options and not stats.saltedKeys):
+        raise AssertionError('No hot key was salted')
+    return stats
+
+# Jobs that are only checked, after the jobs of benchmarkJobs.JOBS.
+CHECK_JOBS = [
+    ('Types', run_types, ['discourse.txt']),
+    ('HotKeys', run_letters, ['discourse.txt']),
+    ('HotKeys/associative', run_letters_associative, ['discourse.txt']),
+]
+
+# Jobs with bad arguments, which fail when the map tasks are made.
+def run_missing_file(dataDir, options):
+    return MapReduce.execute([os.path.join(dataDir, 'missing.txt')],
+                             letters_mapper, letters_reducer, 'TEXT',
+                             **options)
+
+def run_unknown_format(dataDir, options):
+    return MapReduce.execute([os.path.join(dataDir, 'discourse.txt')],
+                             letters_mapper, letters_reducer, 'NO-FORMAT',
+                             **options)
+
+def run_unknown_column(dataDir, options):
+    return MapReduce.execute([os.path.join(dataDir, 'Posts.csv')],
+                             letters_mapper, letters_reducer, 'CSV-Header',
+                             columns=['NoSuchColumn'], **options)
+
+ERROR_JOBS = [
+    ('MissingFile', run_missing_file, ['missing.txt']),
+    ('UnknownFormat', run_unknown_format, ['discourse.txt']),
+    ('UnknownColumn', run_unknown_column, ['Posts.csv']),
+]
+
+def sample_dir(directory):
+    for fileName, samples in SAMPLES.items():
+        dataFile = open(os.path.join(directory, fileName), 'wb')
+        for sample in samples:
+            shutil.copyfileobj(open(os.path.join(DATASETS_DIR, sample), 'rb'),
+                               dataFile)
+        dataFile.close()
+    return directory
+
+# The sorted repr() of the results of a job, or None when the job has no
+# input.
+def job_results(run, directory, options):
+    sink = MapReduce.ListSink()
+    if run(directory, dict(options, output=sink)) is None:
+        return None
+    return sorted(repr(item) for item in sink.items)
+
+# The name of the exception raised by a job, or None. IOError and OSError
+# are both EnvironmentError: a missing file raises one or the other
+# depending on whether it is opened or stat()ed first.
+def job_error(run, directory, options):
+    try:
+        for results in variant_results(run, directory, options):
+            pass
+    except EnvironmentError:
+        return 'EnvironmentError'
+    except Exception as error:
+        return type(error).__name__
+    return None
+
+# Run a variant. A job with a cache is run twice, to fill the cache and to
+# read it, and both runs must give the same results.
+def variant_results(run, directory, options):
+    if ('cache_dir' not in options):
+        return [job_results(run, directory, options)]
+    cacheDir = tempfile.mkdtemp(prefix='mapred-')
+    try:
+        options = dict(options, cache_dir=cacheDir)
+        return [job_results(run, directory, options) for i in range(2)]
+    finally:
+        shutil.rmtree(cacheDir, True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', default=None)
+    parser.add_argument('--variants', default=None)
+    parser.add_argument('--scale', type=int, default=None)
+    parser.add_argument('--data-dir', default=os.path.join(BENCHMARK_DIR,
+                                                           'data'))
+    args = parser.parse_args()
+
+    jobs = benchmarkJobs.JOBS + CHECK_JOBS
+    errorJobs = ERROR_JOBS
+    if args.jobs:
+        jobNames = args.jobs.split(',')
+        jobs = [job for job in jobs if job[0] in jobNames]
+        errorJobs = [job for job in errorJobs if job[0] in jobNames]
+    variants = VARIANTS
+    if args.variants:
+        variantNames = args.variants.split(',')
+        variants = [variant for variant in variants
+                    if variant[0] in variantNames]
+
+    sampleDir = None
+    if args.scale is None:
+        sampleDir = tempfile.mkdtemp(prefix='mapred-')
+        directory = sample_dir(sampleDir)
+        MapReduce.BUFFER_PAIRS = BUFFER_PAIRS
+        MapReduce.RUN_CHUNK_VALUES = RUN_CHUNK_VALUES
+        MapReduce.HOT_KEY_MIN_VALUES = HOT_KEY_MIN_VALUES
+    else:
+        directory = data_dir(args.data_dir, args.scale)
+
+    failures = 0
+    try:
+        for jobName, run, inputs in jobs:
+            expected = job_results(run, directory, {})
+            if expected is None:
+                print '%-20s skipped (no input)' % jobName
+                continue
+            for variantName, options in variants:
+                try:
+                    differences = [results for results in
+                                   variant_results(run, directory, options)
+                                   if results != expected]
+                except AssertionError as error:
+                    failures += 1
+                    print '%-20s %-16s FAILED (%s)' % (jobName, variantName,
+                                                       error)
+                    continue
+                if differences:
+                    failures += 1
+                    print '%-20s %-16s DIFFERENT (%d results, expected %d)' % (
+                        jobName, variantName, len(differences[0]),
+                        len(expected))
+                else:
+                    print '%-20s %-16s ok' % (jobName, variantName)
+                sys.stdout.flush()
+        for jobName, run, inputs in errorJobs:
+            expected = job_error(run, directory, {})
+            for variantName, options in variants:
+                error = job_error(run, directory, options)
+                if (expected is None or error != expected):
+                    failures += 1
+                    print '%-20s %-16s RAISED %s (expected %s)' % (
+                        jobName, variantName, error, expected)
+                else:
+                    print '%-20s %-16s ok (%s)' % (jobName, variantName,
+                                                    error)
+                sys.stdout.flush()
+    finally:
+        if sampleDir is not None:
+            shutil.rmtree(sampleDir, True)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
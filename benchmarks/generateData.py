@@ -0,0 +1,215 @@
+import os
+import sys
+import random
+
+"""
+Generators of synthetic data sets for the benchmarks of the lab
+applications. Every data set is written in the format of the samples in
+the datasets directory and its size grows linearly with a scale factor.
+"""
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Application Usage:
+#
+#   python generateData.py arg-1 arg-2
+#
+#   arg-1 : Directory in which the data sets are created.
+#   arg-2 : Scale factor. 1 generates the smallest data sets, 10 generates
+#           data sets that are ten times larger and so on.
+#
+# The following files are created in the directory:
+#   Posts.csv, Users.csv      - StackExchange tables, in the format written
+#                               by mapred-lab2\XmlToCsv.py
+#   Posts.xml, Users.xml      - StackExchange dumps (SOXML)
+#   discourse.txt             - Plain text for the word count
+#   commonWords.txt           - Words left out of the word count
+#   matrix.csv                - Matrices A and B for the matrix multiply
+#   bookBuddies.csv           - First level book recommendations
+#   images\, imageList.txt    - PNG images, some of them duplicates, and the
+#                               list of their file names (needs Pillow)
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+# Size of the data sets for a scale factor of 1.
+POSTS = 20000
+USERS = 5000
+TEXT_LINES = 20000
+MATRIX_SIZE = 20
+BOOKS = 5000
+IMAGES = 40
+
+# Seed of the random generator, so that the data sets can be recreated.
+SEED = 1
+
+_POSTS_COLUMNS = ['Id', 'PostTypeId', 'Score', 'ViewCount', 'OwnerUserId',
+                  'AnswerCount', 'CommentCount', 'AcceptedAnswerId',
+                  'CommentsCount']
+_USERS_COLUMNS = ['Id', 'Reputation', 'DisplayName', 'UpVotes', 'DownVotes']
+
+_COMMON_WORDS = ['a', 'an', 'the', 'is', 'of', 'and', 'to', 'in', 'that',
+                 'it', 'for', 'on', 'with', 'as', 'be', 'this', 'by', 'are']
+
+# Words used to build text and titles. The vocabulary of the discourse
+# sample is used when it is available. Its words with non ASCII characters
+# (Windows-1252 quotes) are left out, so that the XML dumps are valid UTF-8.
+def _vocabulary():
+    sampleFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'datasets', 'Swami_discourse',
+                              'DD_Nov_21_2000.txt')
+    if os.path.exists(sampleFile):
+        words = sorted(word for word in set(open(sampleFile).read().split())
+                       if all(ord(char) < 128 for char in word))
+    else:
+        words = ['word%d' % i for i in range(5000)]
+    return words + _COMMON_WORDS * 20
+
+def _title(rand, words):
+    return ' '.join(rand.choice(words) for i in range(rand.randint(2, 14)))
+
+def _post(rand, words, postId, numUsers):
+    postType = rand.choice(['1', '1', '2'])
+    post = {
+        'Id': str(postId),
+        'PostTypeId': postType,
+        'Score': str(rand.randint(-2, 50)),
+        'ViewCount': str(rand.randint(10, 5000)),
+        'OwnerUserId': str(rand.randint(1, numUsers)),
+        'CommentCount': str(rand.randint(0, 10)),
+    }
+    if (postType == '1'):
+        post['AnswerCount'] = str(rand.choice([0, 0, 1, 2, 3, 5]))
+        post['Title'] = _title(rand, words).replace(',', ' ')
+        if (rand.random() < 0.5):
+            post['AcceptedAnswerId'] = str(rand.randint(1, postId + 1))
+    return post
+
+def _user(rand, userId):
+    return {
+        'Id': str(userId),
+        'Reputation': str(int(rand.paretovariate(1.2) * 10)),
+        'DisplayName': 'user%d' % userId,
+        'UpVotes': str(rand.randint(0, 500)),
+        'DownVotes': str(rand.randint(0, 50)),
+    }
+
+def _csv_line(tableName, columns, row):
+    return ','.join([tableName] + [row.get(column, '') for column in columns])
+
+def _xml_escape(text):
+    return (text.replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;').replace('"', '&quot;'))
+
+def _xml_line(row):
+    attributes = ' '.join('%s="%s"' % (name, _xml_escape(value))
+                          for name, value in sorted(row.items()))
+    return '  <row %s />' % attributes
+
+def generate_posts(directory, scale, rand, words):
+    numPosts = POSTS * scale
+    numUsers = USERS * scale
+    csvFile = open(os.path.join(directory, 'Posts.csv'), 'w')
+    xmlFile = open(os.path.join(directory, 'Posts.xml'), 'w')
+    csvFile.write(','.join(['TableName'] + _POSTS_COLUMNS + ['Title']) + '\n')
+    xmlFile.write('<?xml version="1.0" encoding="utf-8"?>\n<posts>\n')
+    for postId in xrange(1, numPosts + 1):
+        post = _post(rand, words, postId, numUsers)
+        csvFile.write(_csv_line('POSTS', _POSTS_COLUMNS + ['Title'], post))
+        csvFile.write('\n')
+        xmlFile.write(_xml_line(post) + '\n')
+    xmlFile.write('</posts>\n')
+    csvFile.close()
+    xmlFile.close()
+
+def generate_users(directory, scale, rand):
+    numUsers = USERS * scale
+    csvFile = open(os.path.join(directory, 'Users.csv'), 'w')
+    xmlFile = open(os.path.join(directory, 'Users.xml'), 'w')
+    csvFile.write(','.join(['TableName'] + _USERS_COLUMNS) + '\n')
+    xmlFile.write('<?xml version="1.0" encoding="utf-8"?>\n<users>\n')
+    for userId in xrange(1, numUsers + 1):
+        user = _user(rand, userId)
+        csvFile.write(_csv_line('USERS', _USERS_COLUMNS, user) + '\n')
+        xmlFile.write(_xml_line(user) + '\n')
+    xmlFile.write('</users>\n')
+    csvFile.close()
+    xmlFile.close()
+
+def generate_text(directory, scale, rand, words):
+    textFile = open(os.path.join(directory, 'discourse.txt'), 'w')
+    for i in xrange(TEXT_LINES * scale):
+        textFile.write(' '.join(rand.choice(words)
+                                for j in range(rand.randint(4, 20))))
+        textFile.write('\n')
+    textFile.close()
+    commonWordsFile = open(os.path.join(directory, 'commonWords.txt'), 'w')
+    commonWordsFile.write(' '.join(_COMMON_WORDS) + '\n')
+    commonWordsFile.close()
+
+# The matrices are square. The number of cells grows with the scale factor.
+def matrix_size(scale):
+    return int(round(MATRIX_SIZE * scale ** 0.5))
+
+def generate_matrix(directory, scale, rand):
+    size = matrix_size(scale)
+    matrixFile = open(os.path.join(directory, 'matrix.csv'), 'w')
+    for matrixName in ('A', 'B'):
+        for i in range(size):
+            for j in range(size):
+                matrixFile.write('%s,%d,%d,%d\n' %
+                                 (matrixName, i, j, rand.randint(0, 9)))
+    matrixFile.close()
+
+# Every book is recommended with a few others. A few popular books are in
+# many of the lists, like in the circulation data.
+def generate_books(directory, scale, rand):
+    numBooks = BOOKS * scale
+    books = ['%010d' % (9780000000 + i) for i in range(numBooks)]
+    popular = books[:max(10, numBooks / 1000)]
+    bookFile = open(os.path.join(directory, 'bookBuddies.csv'), 'w')
+    for book in books:
+        buddies = set(rand.sample(books, rand.randint(1, 6)))
+        buddies.update(rand.sample(popular, rand.randint(0, 2)))
+        buddies.discard(book)
+        if buddies:
+            bookFile.write(','.join([book] + sorted(buddies)) + '\n')
+    bookFile.close()
+
+# Images of 16x16 pixels. A third of them are copies of another image.
+def generate_images(directory, scale, rand):
+    try:
+        from PIL import Image
+    except ImportError:
+        sys.stderr.write('Pillow is not installed: no images generated\n')
+        return
+    imageDir = os.path.join(directory, 'images')
+    if not os.path.exists(imageDir):
+        os.makedirs(imageDir)
+    listFile = open(os.path.join(directory, 'imageList.txt'), 'w')
+    pixelData = []
+    for i in range(IMAGES * scale):
+        if (pixelData and rand.random() < 0.33):
+            pixels = rand.choice(pixelData)
+        else:
+            pixels = [(rand.randint(0, 255), rand.randint(0, 255),
+                       rand.randint(0, 255)) for p in range(16 * 16)]
+            pixelData.append(pixels)
+        image = Image.new('RGB', (16, 16))
+        image.putdata(pixels)
+        fileName = os.path.join(imageDir, 'img%d.png' % i)
+        image.save(fileName)
+        listFile.write(fileName + '\n')
+    listFile.close()
+
+def generate_all(directory, scale):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    rand = random.Random(SEED)
+    words = _vocabulary()
+    generate_posts(directory, scale, rand, words)
+    generate_users(directory, scale, rand)
+    generate_text(directory, scale, rand, words)
+    generate_matrix(directory, scale, rand)
+    generate_books(directory, scale, rand)
+    generate_images(directory, scale, rand)
+
+if __name__ == '__main__':
+    generate_all(sys.argv[1], int(sys.argv[2]))
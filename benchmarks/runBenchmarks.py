@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+
+import generateData
+import benchmarkJobs
+
+"""
+Runs the lab applications on synthetic data sets of increasing size and
+reports their throughput and peak memory.
+"""
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Application Usage:
+#
+#   python runBenchmarks.py [--scales 1,10,100] [--jobs WordCount,SQLJoin]
+#                           [--data-dir DIR] [--options JSON]
+#                           [--save FILE] [--baseline FILE]
+#
+#   --scales   : Scale factors of the data sets (see generateData.py).
+#   --jobs     : Jobs to run. Defaults to all the jobs in benchmarkJobs.JOBS.
+#   --data-dir : Directory for the data sets. A data set is generated once
+#                and reused by later runs.
+#   --options  : JSON object with extra arguments for execute()
+#                (for ex: '{"workers": 4, "compact": true}').
+#   --save     : Write the results to FILE as JSON.
+#   --baseline : Compare the results with a file written by --save. Runs
+#                whose throughput dropped, or whose peak memory grew, by more
+#                than --tolerance (default 10%) are marked as regressions.
+#
+# Every job runs in its own process so that the peak memory of one run does
+# not hide the next one.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def data_dir(baseDir, scale):
+    directory = os.path.join(baseDir, 'scale-%d' % scale)
+    marker = os.path.join(directory, '.complete')
+    if not os.path.exists(marker):
+        sys.stderr.write('Generating data sets at scale %d in %s\n' %
+                         (scale, directory))
+        generateData.generate_all(directory, scale)
+        open(marker, 'w').close()
+    return directory
+
+def input_size(directory, inputs):
+    size = 0
+    for name in inputs:
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            size += sum(os.path.getsize(os.path.join(path, fileName))
+                        for fileName in os.listdir(path))
+        elif os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+def run_job(jobName, directory, options):
+    fd, statsFile = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        command = [sys.executable,
+                   os.path.join(BENCHMARK_DIR, 'benchmarkJobs.py'),
+                   jobName, directory, statsFile, json.dumps(options)]
+        subprocess.check_call(command)
+        if (os.path.getsize(statsFile) == 0):
+            return None
+        return json.load(open(statsFile))
+    finally:
+        os.remove(statsFile)
+
+def result_row(jobName, scale, inputBytes, stats):
+    seconds = sum(stats['wallSeconds'].values())
+    peakKB = max(stats['peakMemoryKB'] or 0, stats['workerPeakMemoryKB'] or 0)
+    return {
+        'job': jobName,
+        'scale': scale,
+        'inputMB': inputBytes / 1048576.0,
+        'records': stats['records'],
+        'seconds': seconds,
+        'recordsPerSecond': stats['records'] / seconds if seconds else 0.0,
+        'mbPerSecond': inputBytes / 1048576.0 / seconds if seconds else 0.0,
+        'peakMB': peakKB / 1024.0,
+        'phases': stats['wallSeconds'],
+    }
+
+def compare(row, baseline, tolerance):
+    for base in baseline:
+        if (base['job'] == row['job'] and base['scale'] == row['scale']):
+            break
+    else:
+        return ''
+    notes = []
+    if (row['recordsPerSecond'] < base['recordsPerSecond'] * (1 - tolerance)):
+        notes.append('SLOWER %.0f%%' %
+                     (100 - 100 * row['recordsPerSecond'] /
+                      base['recordsPerSecond']))
+    if (row['peakMB'] > base['peakMB'] * (1 + tolerance)):
+        notes.append('MEMORY +%.0f%%' %
+                     (100 * row['peakMB'] / base['peakMB'] - 100))
+    return ' '.join(notes)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='1,10,100')
+    parser.add_argument('--jobs', default=None)
+    parser.add_argument('--data-dir', default=os.path.join(BENCHMARK_DIR,
+                                                           'data'))
+    parser.add_argument('--options', default='{}')
+    parser.add_argument('--save', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',')]
+    jobNames = [name for name, run, inputs in benchmarkJobs.JOBS]
+    if args.jobs:
+        jobNames = args.jobs.split(',')
+    jobInputs = dict((name, inputs) for name, run, inputs in
+                     benchmarkJobs.JOBS)
+    options = json.loads(args.options)
+    baseline = []
+    if args.baseline:
+        baseline = json.load(open(args.baseline))['results']
+
+    print '%-18s %6s %9s %10s %9s %11s %8s %9s' % (
+        'job', 'scale', 'input MB', 'records', 'seconds', 'records/s',
+        'MB/s', 'peak MB')
+    results = []
+    for scale in scales:
+        directory = data_dir(args.data_dir, scale)
+        for jobName in jobNames:
+            stats = run_job(jobName, directory, options)
+            if stats is None:
+                print '%-18s %6d  skipped (no input)' % (jobName, scale)
+                continue
+            row = result_row(jobName, scale,
+                             input_size(directory, jobInputs[jobName]), stats)
+            results.append(row)
+            print '%-18s %6d %9.1f %10d %9.2f %11.0f %8.2f %9.1f %s' % (
+                jobName, scale, row['inputMB'], row['records'],
+                row['seconds'], row['recordsPerSecond'], row['mbPerSecond'],
+                row['peakMB'], compare(row, baseline, args.tolerance))
+            sys.stdout.flush()
+
+    if args.save:
+        saveFile = open(args.save, 'w')
+        json.dump({'options': options, 'results': results}, saveFile,
+                  indent=2)
+        saveFile.close()
+
+if __name__ == '__main__':
+    main()
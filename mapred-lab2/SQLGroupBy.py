@@ -47,15 +47,15 @@ mr = MapReduce.MapReduce()
 #  Key Idea : Send all records that belong to one group to the same reducer.
 #
 #  Initial Setup:
-#  1. Read the first line of the input file and store the column names 
-#     as a dictionary. The key will be the column name and the value will
-#     be it's position in the row.
-#     This should be done before calling the execute method of MapReduce
-#     The MapReduce module is designed to skip the first line of a CSV file.
+#  1. The file is read with the CSV-Header format of MapReduce. It reads the
+#     column names from the first line of the file. The columns used by the
+#     mapper are passed to the execute method of MapReduce as a list, and
+#     only these columns are read.
 # 
 #  Mapper:
-#  1. Input:  One line from the file. This will be a list containing the
-#             values of each column of a record.
+#  1. Input:  One line from the file. This will be a record containing the
+#             values of the columns that were asked for. The value of a
+#             column is read by its name, for ex: record.Title
 #  2. Key   : One of the following values based on the length of the title:
 #             a. "1_10" if length is between 1 and 10
 #             b. "11_20" if length is between 11 and 20
@@ -80,16 +80,14 @@ mr = MapReduce.MapReduce()
      to work directly on the XML data instead of csv. 
 """
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Global list to hold column names
-columnNames = {}
+# Columns read from the file
+columnNames = ['PostTypeId', 'Title']
 
-# Record Format : A line from the input file.
+# Record Format : The columns listed in columnNames from a line of the file.
 def mapper(key,record):
         
-    global columnNames
-    
     # Extract the title field from the record
-    title = record[columnNames['Title']]
+    title = record.Title
     
     # Set titleRange to one of the 4 values listed in the comment above based
     # on the length of the title field
@@ -108,23 +106,12 @@ def reducer(key, list_of_values):
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def main():
-  # Extract the first line from the file to get the column names.
-  tableData = open(sys.argv[1])
-  firstLine = tableData.readline()
-  tableData.close()
-  
-  # remove the newline at the end of the line
-  firstLine = firstLine.replace('\n','')
-  columnNamesList = firstLine.split(",")
-  count = 0
-  for columnName in columnNamesList:
-    columnNames[columnName] = count
-    count += 1
-  
-  inputdata = open(sys.argv[1])
+  # The column names are read from the first line of the file by the
+  # CSV-Header format.
   fileNameList = []
   fileNameList.append(sys.argv[1])
-  mr.execute(fileNameList, mapper, reducer,"CSV-SkipFirstLine")
+  mr.execute(fileNameList, mapper, reducer,"CSV-Header",
+             columns=columnNames)
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 if __name__ == '__main__':
@@ -40,15 +40,14 @@ mr = MapReduce.MapReduce()
 #  Key Idea: Send matching records from both tables to the same reducer.
 #
 #  Initial Setup:
-#  1. Read the first line of both the input files and store the column names 
-#     as a dictionary. The key will be the column name and the value will
-#     be it's position in the row.
-#     This should be done before calling the execute method of MapReduce
-#     The MapReduce module is designed to skip the first line of a CSV file.
-#     This should be done for both the tables.
+#  1. Both files are read with the CSV-Header format of MapReduce. It reads
+#     the column names from the first line of each file. The columns used
+#     from each table are passed to the execute method of MapReduce as a
+#     dictionary of lists by file name, and only these columns are read.
 #  Mapper:
-#  1. Input:  One line from the file. This will be a list containing the
-#             values of each column of a record.
+#  1. Input:  One line from the file. This will be a record containing the
+#             values of the columns that were asked for. The value of a
+#             column is read by its name, for ex: record.OwnerUserId
 #  2. Key   : For the POSTS table, OwnerUserId
 #             For the Users table, Id
 #     value : Full record.
@@ -82,26 +81,18 @@ mr = MapReduce.MapReduce()
            a way for the user to speicy the join columns for each table.
 """
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Global list to hold column names
-usersTblColumns = {}
-postsTblColumns = {}
+# Columns read from each table
+usersTblColumns = ['TableName', 'Id', 'DisplayName', 'Reputation']
+postsTblColumns = ['TableName', 'OwnerUserId', 'PostTypeId', 'Title',
+                   'AnswerCount', 'CommentCount']
 
-# Record Format : A line from the input file.
+# Record Format : The columns of the table from a line of the file.
 def mapper(key,record):
         
-    global usersTblColumns
-    global postsTblColumns
-    
-    # Get the column index for column OwnerUserId from the PostsTblColumns dict.
-    postsTblJoinCol = postsTblColumns['OwnerUserId']
-    
-    # Get the column index for column Id from the UsersTblColumns dict.
-    usersTblJoinCol = usersTblColumns['Id']
-    
     # Determine if the row is from the Users table or from the Posts table.
-    # Use the first column to identify the table. For the Posts table, the
-    # key should be the value of postsTblJoinCol. What should be the key for
-    # the users table? 
+    # Use the TableName column to identify the table. For the Posts table, 
+    # the key should be the value of record.OwnerUserId. What should be the
+    # key for the users table? 
     # Also determine is record corresponds to a question. 
     # The PostTypeId column for record from the Posts table will be "1" if 
     # it is a question. Set isQuestion to "1" for all records from users table.
@@ -127,38 +118,13 @@ def reducer(key, list_of_values):
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def main():
-  # Extract the first line from the file to get the column names.
-  usersTblData = open(sys.argv[1])
-  firstLine = usersTblData.readline()
-  usersTblData.close()
-  
-  # remove the newline at the end of the line
-  firstLine = firstLine.replace('\n','')
-  columnNamesList = firstLine.split(",")
-  count = 0
-  for columnName in columnNamesList:
-    usersTblColumns[columnName] = count
-    count += 1
-  
-  columnNamesList = []
-  firstLine = ""
-  postsTblData = open(sys.argv[2])
-  firstLine = postsTblData.readline()
-  postsTblData.close()
-  
-  # remove the newline at the end of the line
-  firstLine = firstLine.replace('\n','')
-  columnNamesList = firstLine.split(",")
-  count = 0
-  for columnName in columnNamesList:
-    postsTblColumns[columnName] = count
-    count += 1
-  
-  
+  # The column names of both tables are read from the first line of their
+  # files by the CSV-Header format.
   fileNameList = []
   fileNameList.append(sys.argv[1])
   fileNameList.append(sys.argv[2])
-  mr.execute(fileNameList, mapper, reducer,"CSV-SkipFirstLine")
+  columns = {sys.argv[1]: usersTblColumns, sys.argv[2]: postsTblColumns}
+  mr.execute(fileNameList, mapper, reducer,"CSV-Header", columns=columns)
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
 if __name__ == '__main__':
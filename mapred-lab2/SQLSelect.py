@@ -37,15 +37,15 @@ mr = MapReduce.MapReduce()
 #            to the same reducer.
 #
 #  Initial Setup:
-#  1. Read the first line of the input file and store the column names 
-#     as a dictionary. The key will be the column name and the value will
-#     be it's position in the row.
-#     This should be done before calling the execute method of MapReduce
-#     The MapReduce module is designed to skip the first line of a CSV file.
+#  1. The file is read with the CSV-Header format of MapReduce. It reads the
+#     column names from the first line of the file. The columns used by the
+#     mapper are passed to the execute method of MapReduce as a list, and
+#     only these columns are read.
 # 
 #  Mapper:
-#  1. Input:  One line from the file. This will be a list containing the
-#             values of each column of a record.
+#  1. Input:  One line from the file. This will be a record containing the
+#             values of the columns that were asked for. The value of a
+#             column is read by its name, for ex: record.Title
 #  2. Key   : AnswerCount
 #     value : (Title, Score, ViewCount, CommentsCount)
 #     Do not emit anything if the AnswerCount field is NULL. 
@@ -72,23 +72,18 @@ mr = MapReduce.MapReduce()
      The column names should be treated in a case-insensitive manner.
 """
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Global list to hold column names
-columnNames = {}
+# Columns read from the file
+columnNames = ['AnswerCount', 'Title', 'Score', 'ViewCount', 'CommentsCount']
 
-# Record Format : A line from the input file.
+# Record Format : The columns listed in columnNames from a line of the file.
 def mapper(key,record):
         
-    global columnNames
-    
-    # Get the column index for column AnswerCount from the columnNames dict.
-    answerCountIdx = columnNames['AnswerCount']
-    
     # Extract the value of AnswerCount from the record. This will be the key 
     # emitted by the mapper. It is possible that the key is null if there 
     # is no value for the AnswerCount field.
-    answerCount = record[answerCountIdx]
+    answerCount = record.AnswerCount
     
-    # Get the column index for Title, Score, ViewCount and CommentsCount
+    # Get the values of Title, Score, ViewCount and CommentsCount
     
     
     # Setup the value as a tuple "val = (a,b,c) "
@@ -104,28 +99,12 @@ def reducer(key, list_of_values):
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def main():
-  # Extract the first line from the file to get the column names.
-  tableData = open(sys.argv[1])
-  firstLine = tableData.readline()
-  tableData.close()
-  
-  # remove the newline at the end of the line
-  firstLine = firstLine.replace('\n','')
-  
-  # Extract the list of column names
-  columnNamesList = firstLine.split(",")
-  
-  # Assign the column index to each column.
-  colIndex = 0
-  for columnName in columnNamesList:
-    columnNames[columnName] = colIndex
-    colIndex += 1
-  
-  # Call map reduce.
-  inputdata = open(sys.argv[1])
+  # Call map reduce. The column names are read from the first line of the
+  # file by the CSV-Header format.
   fileNameList = []
   fileNameList.append(sys.argv[1])
-  mr.execute(fileNameList, mapper, reducer,"CSV-SkipFirstLine")
+  mr.execute(fileNameList, mapper, reducer,"CSV-Header",
+             columns=columnNames)
 
 # ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++  
 if __name__ == '__main__':
@@ -3,89 +3,4009 @@
 # Modifications   : 1. Added support for the following file formats
 #                          a. Comma Separated Values (2 variants)
 #                          b. XML files containing the StackExchange dump.
-#                          c. Plain text files. 
+#                          c. Plain text files.
 #                          d. Image files
+#                   2. Parallel map phase on a pool of worker processes
+#                      (execute(..., workers=N)).
+#                   3. Hash partitioned parallel reduce phase with a
+#                      pluggable partitioner.
+#                   4. Map side combiner (execute(..., combiner=f)).
+#                   5. Spilling of intermediate data to sorted runs on disk
+#                      above a memory limit (execute(..., memory_limit=n)).
+#                   6. Streaming reader for the StackExchange XML dumps.
+#                   7. Registry of input formats (register_input_format) and
+#                      batched delivery of records (execute(..., batch_size=n)).
+#                   8. Byte range splits of large TEXT, CSV and JSON files
+#                      for the parallel map phase.
+#                   9. Reducer output is streamed to a buffered output sink
+#                      (execute(..., output=..., output_format=...)).
+#                  10. Compact storage of the intermediate data
+#                      (execute(..., compact=True)).
+#                  11. Job statistics: time per phase, record and key counts
+#                      and memory use (execute() returns a JobStats).
+#                  12. Detection of hot keys and salting of hot keys for
+#                      jobs with a combiner or an associative reducer.
+#                  13. Memory mapped reading of TEXT, CSV and JSON files
+#                      (execute(..., use_mmap=True)).
+#                  14. Reading of gzip, bz2 and xz compressed input files.
+#                  15. Cache of the map output of every input file
+#                      (execute(..., cache_dir=...)).
+#                  16. Pipelines of map/reduce stages with in-memory handoff
+#                      between the stages (Pipeline).
+#                  17. Reading of the input on a background thread ahead of
+#                      the mapper (execute(..., prefetch=n)).
+#                  18. Job server with warm worker processes that runs lab
+#                      scripts submitted over a local socket
+#                      (python MapReduce.py serve / submit).
+#                  19. Execution of jobs on worker nodes over TCP, with the
+#                      shuffle between the nodes (execute(..., cluster=...)).
+#                  20. Retries, timeouts and speculative copies of the tasks of
+#                      the parallel phases, and skipping of bad records.
+#                  21. Mappers and reducers written as generators that yield
+#                      their output, without a global MapReduce object.
+#                  22. Values passed to the reducer as a one-pass stream that
+#                      is read from the spilled runs in chunks
+#                      (execute(..., stream_values=True)).
+#                  23. CSV files read by the column names of their header line,
+#                      keeping only the columns a job needs (CSV-Header,
+#                      execute(..., columns=[...])).
+#                  24. Filters on the values of columns that the readers apply
+#                      before the mapper is called (execute(..., where=...)).
+#                  25. Binary frames for the intermediate data written to
+#                      runs, cache entries and between processes
+#                      (execute(..., serializer=...)).
+import os
+import re
+import sys
+import time
 import json
 import csv
-from PIL import Image
-import xml.etree.ElementTree as ET
+import codecs
+import mmap
+import zlib
+import bz2
+import array
+import heapq
+import operator
+import cPickle
+import cStringIO
+import marshal
+import struct
+import hashlib
+import timeit
+import tempfile
+import collections
+import itertools
+import contextlib
+import types
+import inspect
+import weakref
+import threading
+import Queue
+import argparse
+import traceback
+import socket
+from multiprocessing import connection
+import multiprocessing
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+# PIL is only needed for the IMAGE file format. Labs that do not process
+# images can run without Pillow installed.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# lzma is only needed for xz compressed input files. It is part of the
+# standard library from Python 3.3 and is available as backports.lzma for
+# Python 2.
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# resource is used to report the peak memory of a job. It is not available
+# on Windows.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Number of records sent to a worker process in one map task when a file is
+# split into chunks by the parallel map phase.
+RECORDS_PER_TASK = 10000
+
+# Files of splittable formats that are larger than this many bytes are split
+# into byte ranges that are mapped in parallel.
+SPLIT_SIZE = 64 * 1024 * 1024
+
+# Number of intermediate (key, value) pairs emitted by a mapper after which
+# the combiner is run over the intermediate data and its size is checked
+# against the memory limit.
+BUFFER_PAIRS = 100000
+
+# A run of the combiner over the buffer of the map phase walks all its keys
+# and calls the combiner for some of them. It is run again once this many
+# pairs per key walked and per call have been emitted (see _combine_buffer).
+COMBINE_PAIRS_PER_KEY = 4
+
+# The values of a key are written to a run in chunks of this many values,
+# and a frame of a run holds about this many values. A reducer with
+# stream_values reads one frame per run at a time.
+RUN_CHUNK_VALUES = 10000
+
+# The auto serializer compares the binary and pickle forms of this many
+# records (or keys, with their first SERIALIZER_PROBE_VALUES values) at the
+# start of a stream of frames, and uses pickle when the binary form is
+# slower, or more than BINARY_SIZE_FACTOR times larger: the time to copy and
+# write the larger frames is not part of the comparison.
+SERIALIZER_PROBE_RECORDS = 1000
+SERIALIZER_PROBE_VALUES = 10
+SERIALIZER_PROBE_WINDOW = 20000
+BINARY_SIZE_FACTOR = 1.5
+
+# Number of bytes read from a compressed input file at a time.
+COMPRESSED_BLOCK_SIZE = 1024 * 1024
+
+# Number of results of a pipeline stage kept in memory for the next stage.
+# Further results are written to a run file.
+HANDOFF_ITEMS = 100000
+
+# Number of records of an input file that the prefetch thread puts in its
+# queue at a time.
+PREFETCH_RECORDS = 1000
+
+# Number of lines of a CSV-Header file that are split and turned into
+# records together.
+CSV_BATCH_LINES = 1000
+
+# A task is a straggler when it has run this many times longer than the
+# median task, once SPECULATIVE_MIN_TASKS tasks have finished. A speculative
+# copy of a straggler is started on another worker.
+SPECULATIVE_FACTOR = 3.0
+SPECULATIVE_MIN_TASKS = 5
+
+# Seconds the task scheduler waits for the oldest running task before it
+# checks the other tasks for failures, timeouts and stragglers.
+TASK_POLL_SECONDS = 0.05
+
+# Number of finished tasks per worker whose results the task scheduler holds
+# while it waits for an earlier task.
+TASK_WINDOW = 4
+
+# Number of bytes of output of a job run by the job server that are collected
+# before they are sent to the client.
+JOB_OUTPUT_BYTES = 64 * 1024
+
+# Environment variables with the worker nodes of the default cluster
+# ("host:port,host:port") and the key that authenticates the coordinator and
+# the nodes to each other, and the job server and its clients.
+CLUSTER_ENV = "MAPRED_CLUSTER"
+AUTHKEY_ENV = "MAPRED_AUTHKEY"
+
+# Number of emitted results that are collected before they are written to
+# the output sink in one write.
+OUTPUT_BUFFER_ITEMS = 1000
+
+# A key is hot when it holds more than this share of all the intermediate
+# values, and more than HOT_KEY_MIN_VALUES values.
+HOT_KEY_SHARE = 0.05
+HOT_KEY_MIN_VALUES = 10000
+
+# Number of keys with the most pairs kept from the sample of the pairs
+# emitted by every map task.
+HOT_SAMPLE_KEYS = 100
+
+# Number of keys with the most values listed in the job statistics.
+TOP_KEYS = 10
+
+# Number of keys, and values per key, sampled to estimate the size of the
+# intermediate data.
+SIZE_SAMPLE_KEYS = 100
+SIZE_SAMPLE_VALUES = 10
+
+# Every MapReduce object created in this process. Worker processes use this
+# to capture the values emitted by a mapper through the global 'mr' object of
+# the job script.
+_liveEngines = weakref.WeakSet()
 
 class MapReduce:
     def __init__(self):
         self.intermediate = {}
         self.result = []
+        self.sink = None
+        self.stats = None
+        self.combiner = None
+        self.memoryLimit = None
+        self.numPartitions = 1
+        self.partitioner = default_partitioner
+        self.spillDir = None
+        self.spillRuns = []
+        self.serializer = "auto"
+        self.compact = False
+        self.emittedPairs = 0
+        self.pendingPairs = 0
+        self.bufferLimit = sys.maxint
+        self.uncombinedPairs = 0
+        self.combinePairs = BUFFER_PAIRS
+        self.keySample = None
+        self.samplePairs = 0
+        _liveEngines.add(self)
 
     def emit_intermediate(self, key, value):
         self.intermediate.setdefault(key, [])
         self.intermediate[key].append(value)
 
+    # emit_intermediate of a job with a combiner or a memory limit. The
+    # pairs are counted, and the buffer is combined or spilled every
+    # bufferLimit pairs.
+    def _emit_counted(self, key, value):
+        self.intermediate.setdefault(key, []).append(value)
+        self.pendingPairs += 1
+        if (self.pendingPairs >= self.bufferLimit):
+            self._buffer_full()
+
+    # emit_intermediate of the compact store. Keys are interned and the
+    # values of a key are kept in a CompactValues object.
+    def _emit_compact(self, key, value):
+        values = self.intermediate.get(key)
+        if values is None:
+            values = CompactValues()
+            self.intermediate[_intern_key(key)] = values
+        values.append(value)
+        self.pendingPairs += 1
+        if (self.pendingPairs >= self.bufferLimit):
+            self._buffer_full()
+
+    # Called when bufferLimit pairs have been emitted since the last call.
+    # The intermediate data is combined once combinePairs pairs have been
+    # emitted since it was last combined, and, if it is larger than the
+    # memory limit, combined and written to disk.
+    def _buffer_full(self):
+        self._sample_keys()
+        self.emittedPairs += self.pendingPairs
+        self.uncombinedPairs += self.pendingPairs
+        self.pendingPairs = 0
+        if (self.combiner is not None and
+            self.uncombinedPairs >= self.combinePairs):
+            self._combine_buffer()
+        if (self.memoryLimit is not None and
+            _estimate_size(self.intermediate) > self.memoryLimit):
+            if (self.combiner is not None and self.uncombinedPairs):
+                self._combine_buffer()
+                if (_estimate_size(self.intermediate) <= self.memoryLimit):
+                    return
+            self._spill()
+
+    # Combine the buffer while the map phase runs. Every run walks all the
+    # keys of the buffer, so when the keys are many and their values few,
+    # running it every BUFFER_PAIRS pairs costs more than the mapper. The
+    # next run waits for at least COMBINE_PAIRS_PER_KEY pairs per key walked
+    # and per call of the combiner in this run, so the buffer holds at most
+    # a few times more values than keys.
+    def _combine_buffer(self):
+        numKeys, numCalls = self._combine()
+        self.combinePairs = max(self.combinePairs,
+                                (numKeys + numCalls) * COMBINE_PAIRS_PER_KEY)
+        self.uncombinedPairs = 0
+
+    # Fold the list of values of every key with the combiner. The combiner
+    # is called as combiner(key, list_of_values) and returns the new list of
+    # values for the key. It must accept lists that contain its own output.
+    # Returns the number of keys and the number of calls of the combiner.
+    def _combine(self):
+        numCalls = 0
+        for key in self.intermediate:
+            values = self.intermediate[key]
+            if (len(values) > 1):
+                self.intermediate[key] = self.combiner(key,
+                                                       _values_list(values))
+                numCalls += 1
+        return len(self.intermediate), numCalls
+
+    # Write the intermediate data to a sorted run on disk and start a new
+    # in-memory buffer.
+    def _spill(self):
+        if self.intermediate:
+            self.spillRuns.append(_write_run(self.intermediate,
+                                             self.numPartitions,
+                                             self.partitioner,
+                                             self.spillDir,
+                                             self.serializer))
+            self.intermediate = {}
+
+    def _remove_spill_runs(self):
+        for path, segments in self.spillRuns:
+            os.remove(path)
+        self.spillRuns = []
+
+    def _configure(self, combiner=None, memoryLimit=None, numPartitions=1,
+                   partitioner=None, spillDir=None, compact=False,
+                   serializer="auto", sampleKeys=False):
+        if serializer not in SERIALIZERS:
+            raise ValueError("Unknown serializer: %s" % serializer)
+        self.compact = compact
+        self.serializer = serializer
+        if compact:
+            self.emit_intermediate = self._emit_compact
+        elif (combiner is not None or memoryLimit is not None):
+            self.emit_intermediate = self._emit_counted
+        elif "emit_intermediate" in self.__dict__:
+            del self.emit_intermediate
+        self.combiner = combiner
+        self.memoryLimit = memoryLimit
+        self.numPartitions = numPartitions
+        self.partitioner = partitioner or default_partitioner
+        self.spillDir = spillDir
+        self.spillRuns = []
+        self.emittedPairs = 0
+        self.pendingPairs = 0
+        self.uncombinedPairs = 0
+        self.combinePairs = BUFFER_PAIRS
+        self.keySample = [] if sampleKeys else None
+        self.samplePairs = 0
+        if (combiner is not None or memoryLimit is not None):
+            self.bufferLimit = BUFFER_PAIRS
+        else:
+            self.bufferLimit = sys.maxint
+
+    # Add the (key, value) pairs yielded by a generator mapper for every
+    # record to the intermediate data. This does the work of
+    # emit_intermediate without a method call per pair.
+    def _map_generator(self, mapper, key, records):
+        compact = self.compact
+        intermediate = self.intermediate
+        bufferLimit = self.bufferLimit
+        pendingPairs = self.pendingPairs
+        try:
+            for record in records:
+                for pairKey, value in mapper(key, record):
+                    values = intermediate.get(pairKey)
+                    if values is not None:
+                        values.append(value)
+                    elif compact:
+                        values = CompactValues()
+                        values.append(value)
+                        intermediate[_intern_key(pairKey)] = values
+                    else:
+                        intermediate[pairKey] = [value]
+                    pendingPairs += 1
+                if (pendingPairs >= bufferLimit):
+                    self.pendingPairs = pendingPairs
+                    self._buffer_full()
+                    # The buffer is replaced when it is spilled.
+                    intermediate = self.intermediate
+                    pendingPairs = self.pendingPairs
+        finally:
+            self.pendingPairs = pendingPairs
+
+    # The number of pairs emitted since the job was configured. Without a
+    # combiner or a memory limit the pairs are not counted as they are
+    # emitted: nothing is combined or spilled, so they are all in the
+    # intermediate data.
+    def _emitted_pairs(self):
+        if (self.bufferLimit == sys.maxint):
+            return _count_values(self.intermediate)
+        return self.emittedPairs + self.pendingPairs
+
+    # Count the values of every key in the buffer of a map task, once: the
+    # first time the buffer is combined or spilled, or when the task ends.
+    # The counts are those of the pairs emitted by the mapper, before the
+    # combiner folded them. Only the HOT_SAMPLE_KEYS keys with the most
+    # values are kept, as (count, key).
+    def _sample_keys(self):
+        if (self.keySample is None or self.samplePairs):
+            return
+        self.samplePairs = _count_values(self.intermediate)
+        self.keySample = heapq.nlargest(HOT_SAMPLE_KEYS,
+                                        ((len(values), key) for key, values
+                                         in self.intermediate.iteritems()),
+                                        key=operator.itemgetter(0))
+
+    # Add the sample of a map task that emitted numPairs pairs to 'stats'
+    # and start the sample of the next task.
+    def _add_key_sample(self, stats, numPairs):
+        self._sample_keys()
+        if self.samplePairs:
+            stats.add_key_sample(self.keySample, numPairs, self.samplePairs)
+        self.keySample = []
+        self.samplePairs = 0
+
     def emit(self, value):
-        self.result.append(value) 
+        self.result.append(value)
+        if (self.sink is not None and
+            len(self.result) >= OUTPUT_BUFFER_ITEMS):
+            self._flush_result()
+
+    # emit() for every item of items.
+    def _emit_all(self, items):
+        self.result.extend(items)
+        if (self.sink is not None and
+            len(self.result) >= OUTPUT_BUFFER_ITEMS):
+            self._flush_result()
+
+    # Write the results emitted so far to the output sink.
+    def _flush_result(self):
+        if self.result:
+            self._write_output(self.result)
+            self.result = []
+
+    def _write_output(self, items):
+        with self.stats.phase("output"):
+            self.sink.write(items)
+        self.stats.results += len(items)
     # data - Name of the Input File
-    # 
-            
-    def execute(self, fileNameList, mapper, reducer,fileFormat):
-        for fileName in fileNameList:
-            if (fileFormat <> "SOXML" and fileFormat <> "IMAGE"):
-                data = open(fileName)
-            
-            if (fileFormat == "JSON"):
-                for line in data:
-                    record = json.loads(line)
-                    mapper(fileName,record)
-            
-            if (fileFormat == "CSV-SkipFirstLine"):
-                csvReader = csv.reader(data,delimiter=',')
-                #skip the first line
-                firstLine = 0
-                for line in csvReader:
-                    if firstLine <> 0:
-                        mapper(fileName,line)
-                    else:
-                        firstLine = 1
-                    
-            if (fileFormat == "CSV"):
-                csvReader = csv.reader(data,delimiter=',')
-                
-                for line in csvReader:
-                    mapper(fileName,line)
-                    
-            if (fileFormat == "TEXT"):
-                for line in data:
-                    mapper(fileName,line)
-            
-            if (fileFormat == "IMAGE"):
-                imageFile = Image.open(fileName)
-                imageData = list(imageFile.getdata())
-                mapperInput = []
-                mapperInput.append(fileName)
-                mapperInput.append(imageData)
-                mapper(fileName,mapperInput)
-                    
-            # SOXML is used to identify XML file dumps of StackExchange datasets.
-            # In all StackExchange XML files, the main data is stored as attributes
-            # of the xml element 'row'. We extract the attributes of the element as
-            # a dictionary and pass that to the mapper. The mapper is responsible for
-            # extracting the correct attributes from the dictionary.
-            if (fileFormat == "SOXML"):
-                xmlTree = ET.parse(fileName)
-                treeRoot = xmlTree.getRoot()
-                for child in root:
-                    if (child.tag == "row"):
-                        mapper(fileName,child.attrib)
-        
+    #
+    # mapper       - Function (key, record). It calls emit_intermediate() for
+    #                every (key, value) pair, or, if it is a generator
+    #                function, yields the pairs. A generator mapper is faster:
+    #                its pairs go straight into the intermediate data.
+    # reducer      - Function (key, list_of_values). It calls emit() for every
+    #                result, or, if it is a generator function, yields them.
+    #                Jobs with generator functions need no MapReduce object of
+    #                their own (see the module function execute()).
+
+    # workers      - Number of worker processes. The map and reduce phases
+    #                run in parallel when this is more than 1.
+    # partitions   - Number of partitions the intermediate keys are split into
+    #                for the parallel reduce phase. Defaults to workers.
+    # partitioner  - Function (key, numPartitions) -> partition number.
+    #                Defaults to default_partitioner.
+    # combiner     - Function (key, list_of_values) -> list_of_values used to
+    #                fold the values of a key before they reach the reducer.
+    #                It runs at the end of every map task and whenever
+    #                BUFFER_PAIRS pairs have been emitted, so the reducer
+    #                sees combined values and not the mapper output.
+    # memory_limit - Approximate size in bytes of the intermediate data kept
+    #                in memory. Above this size the data is written to sorted
+    #                runs in spill_dir (default: the system temp directory)
+    #                and the reducers are called with the keys in sorted
+    #                order while the runs are merged. The keys must be
+    #                comparable with each other.
+    # batch_size   - When set, the mapper is called with a list of up to
+    #                batch_size records instead of one record per call.
+    # split_size   - Size in bytes of the byte ranges that TEXT, CSV and JSON
+    #                files are split into for the parallel map phase.
+    # output       - Where the results are written: an OutputSink, or the
+    #                name of a file. Defaults to stdout.
+    # compact      - Keep the intermediate data in a compact form: keys are
+    #                interned, a run of equal values is stored once with a
+    #                count and int and float values are stored in typed
+    #                arrays. The reducer still receives a list.
+    # output_format- Format of the results when output is not an OutputSink:
+    #                one of OUTPUT_FORMATS. Defaults to JSON for JSON input
+    #                and TEXT (the results printed one per line) otherwise.
+    # stats_file   - Name of a file the job statistics are written to as
+    #                JSON.
+    # hot_key_share- Share of all the emitted pairs above which a key is
+    #                reported as a hot key in the job statistics (default:
+    #                HOT_KEY_SHARE). The pairs of every map task are counted
+    #                by key before they are combined, on the first
+    #                BUFFER_PAIRS pairs of the task. With workers > 1 the
+    #                values of a hot key are split into one salted group per
+    #                partition, every reduce task folds one group with the
+    #                combiner, which must be associative, and the key is
+    #                reduced over the folded values once the partitions are
+    #                reduced.
+    # associative  - The reducer emits (key, value) pairs, and reducing the
+    #                values of its own results for parts of the values of a
+    #                key gives its result for all of them, as for a sum, a
+    #                minimum or a maximum. A reducer that counts its values,
+    #                (key, len(values)), is not: it would count the results
+    #                of the parts. The hot keys of a job without a combiner
+    #                are then salted too: the reducer folds the salted groups
+    #                and the values of its results are reduced again.
+    # use_mmap     - Read TEXT, CSV and JSON files through a memory map of
+    #                the file. Worker processes reading splits of the same
+    #                file then share the pages of the file.
+    # cache_dir    - Directory of the map output cache. The intermediate data
+    #                of every input file is stored there, and a file that
+    #                has not changed since an earlier run is not mapped
+    #                again: its stored data is used instead.
+    # cache_key    - How the cache decides that a file has not changed:
+    #                "mtime" compares the size and modification time of the
+    #                file, "content" a hash of its contents.
+    # prefetch     - Read and parse the input files on a background thread,
+    #                up to this many chunks of PREFETCH_RECORDS records ahead
+    #                of the mapper. A chunk holds records of one file only, so
+    #                for IMAGE files this is the number of images decoded
+    #                ahead. Used by the serial map phase: with workers > 1
+    #                the files are read while the workers map.
+    # The results emitted by the reducer are written to the output as they
+    # are emitted, so self.result only holds the results that have not been
+    # written yet. The intermediate data and results of an earlier call are
+    # cleared, so one MapReduce object can run many jobs.
+    # In the job server, jobs with workers > 1 run on the worker processes of
+    # the server, whatever the value of workers.
+    # retries      - Number of times a failed task of the parallel phases is
+    #                run again before the job fails. On a cluster, tasks
+    #                that raised an exception are run again.
+    # task_timeout - Seconds after which a running task of the parallel
+    #                phases counts as failed (and is retried). A worker
+    #                process that crashed, or hangs, is only noticed through
+    #                the timeout.
+    # speculative  - Start a second copy of a task that runs much longer
+    #                than the others (see SPECULATIVE_FACTOR). The result of
+    #                the copy that finishes first is used.
+    # skip_bad_records
+    #              - Skip the records that the reader cannot parse (JSON
+    #                lines, CSV rows and images) and the records (or
+    #                batches) for which the mapper raises an exception,
+    #                instead of failing the job. The pairs emitted by a
+    #                mapper call before it failed are kept. The number of
+    #                skipped records is in the job statistics.
+    # stream_values- Pass the values of a key to the reducer as a ValueStream,
+    #                an iterator that can be read once, instead of a list.
+    #                With memory_limit, the values are read from the spilled
+    #                runs while the reducer iterates over them, so a reducer
+    #                that only needs one pass (counting, summing) keeps one
+    #                chunk of values per run in memory, however many values
+    #                the key has.
+    # columns      - The columns of a CSV-Header file that the mapper needs: a
+    #                list of column names (or column numbers) of the header
+    #                line, or a dictionary of such lists by input file name
+    #                for a job over files with different headers. The mapper
+    #                gets a CsvRecord of only these columns, in this order.
+    # where        - A filter on the records, applied by the reader before
+    #                the mapper is called (see Filters): for ex:
+    #                ("and", ("PostTypeId", "==", "1"),
+    #                        ("AnswerCount", "==", 0)).
+    #                Or a dictionary of filters by input file name. Records
+    #                that do not match are counted in the job statistics as
+    #                records read and as filteredRecords.
+    # serializer   - How the intermediate data is written to spilled runs,
+    #                cache entries and the messages between processes: one
+    #                of SERIALIZERS (see Serialization). Defaults to "auto".
+    # cluster      - A Cluster of worker nodes the job runs on. Defaults to the
+    #                nodes listed in the MAPRED_CLUSTER environment variable,
+    #                so that a lab script runs on a cluster unchanged. The
+    #                options of the local worker processes (workers,
+    #                task_timeout, speculative), memory_limit, cache_dir,
+    #                prefetch and the salting of hot keys (hot_key_share,
+    #                associative) are not supported: setting them raises a
+    #                ValueError.
+    # Returns the JobStats of the job, which is also kept in self.stats.
+    def execute(self, fileNameList, mapper, reducer,fileFormat, workers=1,
+                partitions=None, partitioner=None, combiner=None,
+                memory_limit=None, spill_dir=None, batch_size=None,
+                split_size=SPLIT_SIZE, output=None, output_format=None,
+                compact=False, stats_file=None, hot_key_share=HOT_KEY_SHARE,
+                use_mmap=False, cache_dir=None, cache_key="mtime",
+                prefetch=0, retries=0, task_timeout=None, speculative=False,
+                skip_bad_records=False, stream_values=False, columns=None,
+                where=None, serializer="auto", cluster=None,
+                associative=False):
+        # The lab1 applications pass the name of a single file.
+        if isinstance(fileNameList, basestring):
+            fileNameList = [fileNameList]
+        if cluster is None:
+            cluster = Cluster.from_environment()
+        if cluster is not None:
+            unsupported = [name for name, value, default in
+                           (("workers", workers, 1),
+                            ("memory_limit", memory_limit, None),
+                            ("cache_dir", cache_dir, None),
+                            ("prefetch", prefetch, 0),
+                            ("task_timeout", task_timeout, None),
+                            ("speculative", speculative, False),
+                            ("hot_key_share", hot_key_share, HOT_KEY_SHARE),
+                            ("associative", associative, False))
+                           if value != default]
+            if unsupported:
+                raise ValueError("%s not supported on a cluster" %
+                                 ", ".join(unsupported))
+            return self._execute_on_cluster(cluster, fileNameList, mapper,
+                                            reducer, fileFormat, partitions,
+                                            partitioner, combiner, batch_size,
+                                            split_size, output, output_format,
+                                            compact, stats_file, use_mmap,
+                                            retries, skip_bad_records,
+                                            stream_values, columns, where,
+                                            serializer)
+
+        self.intermediate = {}
+        self.result = []
+        stats = JobStats()
+        self.stats = stats
+        readerOptions = {"useMmap": use_mmap,
+                         "skipBadRecords": skip_bad_records,
+                         "columns": columns, "where": where}
+        if output_format is None:
+            output_format = "JSON" if fileFormat == "JSON" else "TEXT"
+
+        numPartitions = 1
+        if (workers > 1):
+            numPartitions = partitions or workers
+        # The map output is sampled where the pairs are emitted: here when the
+        # job is serial, in the map tasks of the cache (_map_chunk) and of
+        # the workers otherwise.
+        self._configure(combiner, memory_limit, numPartitions, partitioner,
+                        spill_dir, compact, serializer,
+                        sampleKeys=(workers <= 1 and cache_dir is None))
+        cache = None
+        if cache_dir is not None:
+            functions = [mapper]
+            if combiner is not None:
+                functions.append(combiner)
+            cache = MapOutputCache(cache_dir,
+                                   _job_fingerprint(functions, fileFormat,
+                                                    batch_size, compact,
+                                                    columns, where,
+                                                    skip_bad_records),
+                                   cache_key, serializer)
+
+        # The sink is opened once the settings of the job are checked, and
+        # is closed on every way out of the job from here on.
+        self.sink = _output_sink(output, output_format)
+        pool = None
+        try:
+            if (workers > 1):
+                functions = [mapper, reducer]
+                if combiner is not None:
+                    functions.append(combiner)
+                job = {"mapper": mapper, "reducer": reducer,
+                       "combiner": combiner, "batchSize": batch_size,
+                       "compact": compact, "readerOptions": readerOptions,
+                       "skipBadRecords": skip_bad_records,
+                       "streamValues": stream_values,
+                       "serializer": serializer}
+                if _serverPool is not None:
+                    pool = _ServerPoolJob(_serverPool, job,
+                                          _job_context(*functions))
+                else:
+                    pool = multiprocessing.Pool(workers, _init_worker,
+                                                (job,
+                                                 _job_context(*functions)))
+                if (retries or task_timeout is not None or speculative):
+                    pool = _TaskScheduler(pool,
+                                          getattr(pool, "workers", workers),
+                                          stats, retries, task_timeout,
+                                          speculative)
+            if skip_bad_records:
+                mapper = _SkippingMapper(mapper, stats)
+            with stats.phase("map"):
+                if pool is not None:
+                    self._parallel_map(pool, fileNameList, fileFormat,
+                                       split_size, readerOptions, cache)
+                else:
+                    self._serial_map(fileNameList, fileFormat, mapper,
+                                     batch_size, readerOptions, cache,
+                                     prefetch)
+                    if cache is None:
+                        numPairs = self._emitted_pairs()
+                        stats.intermediatePairs += numPairs
+                        self._add_key_sample(stats, numPairs)
+            stats.split_map_phase()
+
+            with stats.phase("shuffle"):
+                stats.hotKeys = self._hot_keys(hot_key_share)
+                # The workers have combined the output of every map task,
+                # and the reducer gets all the values of a key anyway.
+                if self.spillRuns:
+                    if combiner is not None:
+                        self._combine()
+                    self._spill()
+                stats.spillRuns = len(self.spillRuns)
+
+            with stats.phase("reduce"):
+                if self.spillRuns:
+                    self._merge_reduce(pool, reducer, stream_values)
+                elif pool is not None:
+                    saltedKeys = []
+                    if (combiner is not None or associative):
+                        saltedKeys = [key for key, numPairs in stats.hotKeys
+                                      if key in self.intermediate]
+                    self._parallel_reduce(pool, reducer, saltedKeys,
+                                          stream_values)
+                else:
+                    _reduce_groups(reducer, self.intermediate.iteritems(),
+                                   stats, self._emit_all, stream_values)
+                if pool is not None:
+                    pool.close()
+                self._flush_result()
+            # Results written by the reducers count as output time.
+            stats.remove_time("reduce", "output")
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+            self._remove_spill_runs()
+            self.sink.close()
+            self.sink = None
+
+        stats.record_memory()
+        _write_stats(stats, stats_file)
+        return stats
+
+    # execute() on the worker nodes of a cluster. The map tasks are sent to
+    # the nodes, and every node keeps the output of its tasks split into
+    # partitions. Every partition is then reduced by one node, which fetches
+    # it from the nodes that hold it. The results are written here in
+    # partition order.
+    def _execute_on_cluster(self, cluster, fileNameList, mapper, reducer,
+                            fileFormat, partitions, partitioner, combiner,
+                            batchSize, splitSize, output, outputFormat,
+                            compact, statsFile, useMmap, retries,
+                            skipBadRecords, streamValues, columns, where,
+                            serializer):
+        self.intermediate = {}
+        self.result = []
+        stats = JobStats()
+        self.stats = stats
+        readerOptions = {"useMmap": useMmap, "skipBadRecords": skipBadRecords,
+                         "columns": columns, "where": where}
+        if outputFormat is None:
+            outputFormat = "JSON" if fileFormat == "JSON" else "TEXT"
+        functions = [mapper, reducer]
+        if combiner is not None:
+            functions.append(combiner)
+        job = {"mapper": mapper, "reducer": reducer, "combiner": combiner,
+               "batchSize": batchSize, "compact": compact,
+               "readerOptions": readerOptions,
+               "numPartitions": partitions or len(cluster.addresses),
+               "partitioner": partitioner or default_partitioner,
+               "skipBadRecords": skipBadRecords,
+               "streamValues": streamValues, "serializer": serializer}
+        clusterJob = _ClusterJob(cluster, job, _job_context(*functions),
+                                 retries)
+        self.sink = _output_sink(output, outputFormat)
+        try:
+            with stats.phase("map"):
+                tasks = _map_tasks(fileNameList, fileFormat, splitSize,
+                                   readerOptions, stats)
+                clusterJob.map(tasks, stats)
+            stats.split_map_phase()
+            with stats.phase("reduce"):
+                for output, taskStats in clusterJob.reduce():
+                    stats.merge(taskStats)
+                    self._write_output(output)
+            stats.remove_time("reduce", "output")
+        finally:
+            clusterJob.end()
+            self.sink.close()
+            self.sink = None
+        stats.record_memory()
+        _write_stats(stats, statsFile)
+        return stats
+
+    # Map the input files in this process. With prefetch, the files that are
+    # not in the cache are read by a _Prefetcher.
+    def _serial_map(self, fileNameList, fileFormat, mapper, batchSize,
+                    readerOptions, cache, prefetch):
+        entryPaths = [None] * len(fileNameList)
+        if cache is not None:
+            entryPaths = [cache.entry_path(fileName)
+                          for fileName in fileNameList]
+        cached = [entryPath is not None and os.path.exists(entryPath)
+                  for entryPath in entryPaths]
+        prefetcher = None
+        if prefetch:
+            prefetcher = _Prefetcher([fileName for fileName, isCached in
+                                      zip(fileNameList, cached)
+                                      if not isCached],
+                                     fileFormat, readerOptions, prefetch)
+        try:
+            for fileName, entryPath, isCached in zip(fileNameList,
+                                                     entryPaths, cached):
+                if isCached:
+                    self._merge_cached(cache, entryPath)
+                    continue
+                if prefetcher is not None:
+                    records = prefetcher.records()
+                else:
+                    records = _read_records(fileName, fileFormat,
+                                            readerOptions=readerOptions)
+                records = _timed_records(records, self.stats)
+                if batchSize:
+                    records = _batches(records, batchSize)
+                if entryPath is not None:
+                    self._map_to_cache(cache, entryPath, fileName, mapper,
+                                       records)
+                    continue
+                _run_mapper(mapper, fileName, records, self)
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+
+    # The map phase is split into tasks which are run on a pool of worker
+    # processes. Each worker maps its task into a local intermediate buffer
+    # and returns it. The buffers are merged in task order so that the list of
+    # values for every key is the same as the one built by the serial path.
+    # With a cache, files that have an entry in the cache are not mapped:
+    # their stored buffers are merged in their place in fileNameList.
+    def _parallel_map(self, pool, fileNameList, fileFormat, splitSize,
+                      readerOptions, cache):
+        entryPaths = [None] * len(fileNameList)
+        mapPositions = set(range(len(fileNameList)))
+        if cache is not None:
+            entryPaths = [cache.entry_path(fileName)
+                          for fileName in fileNameList]
+            mapPositions = set(position for position, path in
+                               enumerate(entryPaths)
+                               if not os.path.exists(path))
+        taskPositions = collections.deque()
+        tasks = _positioned_tasks(fileNameList, sorted(mapPositions),
+                                  fileFormat, splitSize, readerOptions,
+                                  self.stats, taskPositions)
+        nextPosition = 0
+        entry = None
+        try:
+            for frame, taskStats in _pool_imap(pool, _run_pool_map_task,
+                                               tasks):
+                self.stats.merge(taskStats)
+                buffer = decode_frame(frame)
+                position = taskPositions.popleft()
+                if (position >= nextPosition):
+                    if entry is not None:
+                        entry.commit()
+                        entry = None
+                    self._merge_skipped(cache, entryPaths, mapPositions,
+                                        nextPosition, position)
+                    nextPosition = position + 1
+                    if cache is not None:
+                        entry = cache.new_entry(entryPaths[position])
+                if entry is not None:
+                    entry.write_frame(frame)
+                self._merge_buffer(buffer)
+            if entry is not None:
+                entry.commit()
+        finally:
+            if entry is not None:
+                entry.discard()
+        self._merge_skipped(cache, entryPaths, mapPositions, nextPosition,
+                            len(fileNameList))
+
+    # Merge the cached files at the positions [start, end) of the file list.
+    # A file that was mapped but had no task (no records) gets an empty
+    # entry.
+    def _merge_skipped(self, cache, entryPaths, mapPositions, start, end):
+        if cache is None:
+            return
+        for position in range(start, end):
+            if position in mapPositions:
+                cache.new_entry(entryPaths[position]).commit()
+            else:
+                self._merge_cached(cache, entryPaths[position])
+
+    # Add a buffer of intermediate data to self.intermediate.
+    def _merge_buffer(self, buffer):
+        for key in buffer:
+            values = self.intermediate.get(key)
+            if values is None:
+                if self.compact:
+                    key = _intern_key(key)
+                self.intermediate[key] = buffer[key]
+            else:
+                values.extend(buffer[key])
+            self.pendingPairs += len(buffer[key])
+        if (self.pendingPairs >= self.bufferLimit):
+            self._buffer_full()
+
+    def _merge_cached(self, cache, entryPath):
+        for buffer in cache.read_entry(entryPath):
+            self._merge_buffer(buffer)
+        self.stats.cachedFiles += 1
+
+    # Map a file whose output is stored in the cache. The records are mapped
+    # in chunks of RECORDS_PER_TASK records into separate buffers, like the
+    # map tasks of the parallel path, and every buffer is stored before it
+    # is merged into the intermediate data.
+    def _map_to_cache(self, cache, entryPath, fileName, mapper, records):
+        entry = cache.new_entry(entryPath)
+        try:
+            for chunk in _batches(records, RECORDS_PER_TASK):
+                buffer = self._map_chunk(fileName, mapper, chunk)
+                entry.write(buffer)
+                self._merge_buffer(buffer)
+            entry.commit()
+        finally:
+            entry.discard()
+
+    def _map_chunk(self, fileName, mapper, records):
+        intermediate = self.intermediate
+        memoryLimit = self.memoryLimit
+        emittedPairs = self.emittedPairs
+        pendingPairs = self.pendingPairs
+        uncombinedPairs = self.uncombinedPairs
+        keySample = self.keySample
+        self.intermediate = {}
+        self.memoryLimit = None
+        self.emittedPairs = 0
+        self.pendingPairs = 0
+        self.uncombinedPairs = 0
+        self.keySample = []
+        self.samplePairs = 0
+        try:
+            _run_mapper(mapper, fileName, records, self)
+            numPairs = self._emitted_pairs()
+            self.stats.intermediatePairs += numPairs
+            self._add_key_sample(self.stats, numPairs)
+            if self.combiner is not None:
+                self._combine()
+            return self.intermediate
+        finally:
+            self.intermediate = intermediate
+            self.memoryLimit = memoryLimit
+            self.emittedPairs = emittedPairs
+            self.pendingPairs = pendingPairs
+            self.uncombinedPairs = uncombinedPairs
+            self.keySample = keySample
+            self.samplePairs = 0
+
+    # (key, estimated number of pairs) of the keys that hold more than
+    # hotKeyShare of the emitted pairs, from the samples of the map tasks.
+    # The files read from the map output cache are not sampled.
+    def _hot_keys(self, hotKeyShare):
+        limit = max(HOT_KEY_MIN_VALUES,
+                    self.stats.intermediatePairs * hotKeyShare)
+        return sorted(((key, numPairs) for key, numPairs
+                       in self.stats.keyCounts.iteritems()
+                       if numPairs > limit),
+                      key=operator.itemgetter(1), reverse=True)
+
+    # The intermediate keys are split into numPartitions partitions by the
+    # partitioner and each partition is reduced by a worker process. The
+    # output of the partitions is appended to the result in partition order.
+    # The values of every salted key are split into one group per partition
+    # instead, and the reduce task of a partition also folds its group of
+    # every salted key (see _fold_salted_groups). A salted key is then
+    # reduced here over the folded values of all its groups, so that no
+    # worker has to go over all of its values.
+    def _parallel_reduce(self, pool, reducer, saltedKeys, streamValues):
+        partitionList = [[] for i in range(self.numPartitions)]
+        saltedList = [[] for i in range(self.numPartitions)]
+        salted = set(saltedKeys)
         for key in self.intermediate:
-            reducer(key, self.intermediate[key])
-
-        #jenc = json.JSONEncoder(encoding='latin-1')
-        
-        jenc = json.JSONEncoder()
-        
-        if (fileFormat == "JSON"):
-            for item in self.result:
-                print jenc.encode(item)
+            if key in salted:
+                continue
+            partition = self.partitioner(key, self.numPartitions)
+            partitionList[partition].append((key, self.intermediate[key]))
+        for key in saltedKeys:
+            values = _values_list(self.intermediate[key])
+            groupSize = -(-len(values) // self.numPartitions)
+            for salt in range(self.numPartitions):
+                group = values[salt * groupSize:(salt + 1) * groupSize]
+                if group:
+                    saltedList[salt].append((key, group))
+        folded = {}
+        for output, taskStats, foldedGroups in pool.imap(
+                _run_reduce_task, zip(partitionList, saltedList)):
+            self.stats.merge(taskStats)
+            self._write_output(output)
+            for key, values in foldedGroups:
+                folded.setdefault(key, []).extend(values)
+        self.stats.saltedKeys = len(folded)
+        _reduce_groups(reducer, [(key, folded[key]) for key in saltedKeys
+                                 if key in folded],
+                       self.stats, self._emit_all, streamValues)
+
+    # Reduce phase for spilled intermediate data. Every run holds one sorted
+    # segment per partition. A partition is reduced by merging its segments
+    # from all the runs, in the worker processes when there is a pool.
+    def _merge_reduce(self, pool, reducer, streamValues):
+        partitionList = []
+        for partition in range(self.numPartitions):
+            segments = []
+            for path, runSegments in self.spillRuns:
+                start, end = runSegments[partition]
+                if (end > start):
+                    segments.append((path, start, end))
+            partitionList.append(segments)
+        if pool is not None:
+            for output, taskStats in pool.imap(_run_merge_reduce_task,
+                                               partitionList):
+                self.stats.merge(taskStats)
+                self._write_output(output)
+        else:
+            for segments in partitionList:
+                if streamValues:
+                    groups = _stream_segments(segments)
+                else:
+                    groups = _merge_segments(segments)
+                _reduce_groups(reducer, groups, self.stats, self._emit_all,
+                               streamValues)
+
+def _write_stats(stats, statsFile):
+    if statsFile is not None:
+        statsFile = open(statsFile, "w")
+        json.dump(stats.as_dict(), statsFile, indent=2)
+        statsFile.close()
+
+# Call the reducer for every (key, values) pair of groups. The results
+# yielded by a generator reducer are passed to emitAll in lists of about
+# OUTPUT_BUFFER_ITEMS results. With streamValues the reducer gets a
+# ValueStream.
+def _reduce_groups(reducer, groups, stats, emitAll, streamValues=False):
+    if streamValues:
+        groups = _value_streams(groups, stats)
+    elif not _is_generator(reducer):
+        for key, values in groups:
+            values = _values_list(values)
+            stats.add_key(key, len(values))
+            reducer(key, values)
+        return
+    if not _is_generator(reducer):
+        for key, values in groups:
+            reducer(key, values)
+        return
+    output = []
+    for key, values in groups:
+        if not streamValues:
+            values = _values_list(values)
+            stats.add_key(key, len(values))
+        output.extend(reducer(key, values))
+        if (len(output) >= OUTPUT_BUFFER_ITEMS):
+            emitAll(output)
+            output = []
+    if output:
+        emitAll(output)
+
+# Generate (key, ValueStream) for the groups. Values held in memory are one
+# chunk. A key is added to the statistics once its reducer has returned and
+# the values it did not read have been skipped.
+def _value_streams(groups, stats):
+    for key, values in groups:
+        if not isinstance(values, ValueStream):
+            values = ValueStream([values])
+        yield (key, values)
+        stats.add_key(key, values.finish())
+
+# The values of a key as an iterator that can be read once. The values are
+# read chunk by chunk, from lists, CompactValues or the chunks of the spilled
+# runs, without building a list of all of them. len() is not available:
+# a reducer that needs the number of values counts them as it reads them.
+class ValueStream(object):
+    def __init__(self, chunks):
+        self.numValues = 0
+        self.chunks = self._counted(chunks)
+        self.values = itertools.chain.from_iterable(self.chunks)
+
+    def _counted(self, chunks):
+        for chunk in chunks:
+            self.numValues += len(chunk)
+            yield chunk
+
+    def __iter__(self):
+        return self.values
+
+    def next(self):
+        return next(self.values)
+
+    # Skip the values that were not read. Returns the number of values.
+    def finish(self):
+        for chunk in self.chunks:
+            pass
+        return self.numValues
+
+# Call the mapper for every record. The pairs yielded by a generator mapper
+# are added to the intermediate data of 'engine'.
+def _run_mapper(mapper, key, records, engine):
+    if _is_generator(mapper):
+        engine._map_generator(mapper, key, records)
+        return
+    for record in records:
+        mapper(key, record)
+
+# True for generator functions, and for the wrappers of generator mappers
+# (which set isGenerator).
+def _is_generator(function):
+    isGenerator = getattr(function, "isGenerator", None)
+    if isGenerator is not None:
+        return isGenerator
+    return inspect.isgeneratorfunction(function)
+
+# Run a job on a new MapReduce object. For jobs whose mapper and reducer are
+# generator functions and do not need a MapReduce object of their own.
+def execute(fileNameList, mapper, reducer, fileFormat, **options):
+    return MapReduce().execute(fileNameList, mapper, reducer, fileFormat,
+                               **options)
+
+# The default partitioner sends a key to a partition based on its hash.
+def default_partitioner(key, numPartitions):
+    return hash(key) % numPartitions
+
+# The number of values in an intermediate dictionary.
+def _count_values(intermediate):
+    return sum(itertools.imap(len, intermediate.itervalues()))
+
+# Estimate the memory used by an intermediate dictionary from the size of a
+# sample of its keys and values.
+def _estimate_size(intermediate):
+    numKeys = len(intermediate)
+    if (numKeys == 0):
+        return 0
+    sampleSize = 0
+    sampleKeys = 0
+    for key, values in itertools.islice(intermediate.iteritems(),
+                                        SIZE_SAMPLE_KEYS):
+        sampleSize += sys.getsizeof(key) + sys.getsizeof(values)
+        if isinstance(values, CompactValues):
+            values = values.objects()
+        sampleValues = values[:SIZE_SAMPLE_VALUES]
+        if sampleValues:
+            valuesSize = sum(sys.getsizeof(value) for value in sampleValues)
+            sampleSize += valuesSize * len(values) / len(sampleValues)
+        sampleKeys += 1
+    return sys.getsizeof(intermediate) + sampleSize * numKeys / sampleKeys
+
+# Write the intermediate data to a run file sorted by partition and key.
+# Returns the path of the file and the (start, end) offsets of the segment
+# of every partition in the file. A segment is a sequence of frames (see
+# Serialization) of records (key, chunk number, values): lists of more than
+# RUN_CHUNK_VALUES values are written in chunks, and a frame holds about
+# RUN_CHUNK_VALUES values.
+def _write_run(intermediate, numPartitions, partitioner, spillDir,
+               serializer="auto"):
+    entries = sorted((partitioner(key, numPartitions), key)
+                     for key in intermediate)
+    fd, path = tempfile.mkstemp(prefix="mapred-", suffix=".run", dir=spillDir)
+    runFile = os.fdopen(fd, "wb")
+    encoder = FrameEncoder(serializer)
+    segments = [(0, 0)] * numPartitions
+    for partition, keys in itertools.groupby(entries,
+                                             operator.itemgetter(0)):
+        start = runFile.tell()
+        batch = []
+        batchValues = 0
+        for partition, key in keys:
+            for chunkNumber, chunk in enumerate(_run_chunks(intermediate[key])):
+                batch.append((key, chunkNumber, chunk))
+                batchValues += len(chunk) + 1
+                if (batchValues >= RUN_CHUNK_VALUES):
+                    runFile.write(encoder.encode(batch))
+                    batch = []
+                    batchValues = 0
+        if batch:
+            runFile.write(encoder.encode(batch))
+        segments[partition] = (start, runFile.tell())
+    runFile.close()
+    return (path, segments)
+
+def _run_chunks(values):
+    if (type(values) is not list or len(values) <= RUN_CHUNK_VALUES):
+        return [values]
+    return [values[start:start + RUN_CHUNK_VALUES]
+            for start in xrange(0, len(values), RUN_CHUNK_VALUES)]
+
+def _read_segment(runIndex, path, start, end):
+    for records in _file_frames(path, start, end):
+        for key, chunkNumber, values in records:
+            yield (key, runIndex, chunkNumber, values)
+
+# Merge sorted segments of the run files. Generates every key once with the
+# chunks of its values from all the segments, in the order in which the runs
+# were written.
+def _merged_chunks(segments):
+    streams = [_read_segment(runIndex, path, start, end)
+               for runIndex, (path, start, end) in enumerate(segments)]
+    for key, records in itertools.groupby(heapq.merge(*streams),
+                                          lambda record: record[0]):
+        yield (key, (record[3] for record in records))
+
+# Generates every key once with the list of its values.
+def _merge_segments(segments):
+    for key, chunks in _merged_chunks(segments):
+        values = next(chunks)
+        for chunk in chunks:
+            values.extend(chunk)
+        yield (key, values)
+
+# Generates every key once with a ValueStream of its values.
+def _stream_segments(segments):
+    for key, chunks in _merged_chunks(segments):
+        yield (key, ValueStream(chunks))
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Serialization
+#
+# Intermediate data that leaves a process (spilled runs, the buffers that
+# the workers return from map tasks, cache entries, the outputs of pipeline
+# stages and the partitions that cluster nodes fetch from each other) is
+# written as a sequence of frames:
+#   4 bytes  length of the payload, little endian
+#   1 byte   kind of the payload: FRAME_BINARY or FRAME_PICKLE
+#   payload  a batch of records (a list), or a buffer of intermediate data
+# A binary payload is in the format of the marshal module: every value is a
+# type tag ("s" str, "i" int, "g" float, "(" tuple, "[" list, "{" dict ...)
+# followed by its bytes, or by its length and its items. It is written and
+# read by C code, several times faster than pickle, but a value that
+# appears several times is written every time. marshal writes any object
+# with a buffer (array, bytearray, a subclass of str ...) as a str, so only
+# payloads made of the exact types in MARSHAL_TYPES are written in binary
+# (see _marshallable). A pickle payload stores a shared value once, and
+# holds values of any type (for ex: CsvRecord and CompactValues).
+#
+# The serializer of a job is one of:
+#   binary - binary frames, and pickle frames for the batches that have
+#            values of other types.
+#   pickle - pickle frames.
+#   auto   - binary, unless the start of a stream of frames shows that
+#            pickle is faster for its values, or that they are shared
+#            between keys (see _probe_sample), as when a job
+#            emits a whole record for many keys. The stream is then written
+#            in pickle frames.
+# Frames are read from a str, a buffer or a memory map without copying the
+# payloads: Python 2 reads a memory map through buffer objects.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+SERIALIZERS = ("auto", "binary", "pickle")
+
+FRAME_BINARY = "B"
+FRAME_PICKLE = "P"
+_FRAME_HEADER = struct.Struct("<Ic")
+
+# The types that marshal writes and reads back as they are. A payload nested
+# deeper than MARSHAL_MAX_DEPTH containers (or a list that holds itself) is
+# written with pickle.
+MARSHAL_CONTAINERS = frozenset([tuple, list, dict])
+MARSHAL_TYPES = MARSHAL_CONTAINERS | frozenset([str, unicode, int, long,
+                                                float, bool, types.NoneType])
+MARSHAL_MAX_DEPTH = 100
+# The types of the values that pickle writes once per object.
+MEMO_TYPES = frozenset([tuple, list, dict, str, unicode])
+
+# Encodes the batches of one stream of frames.
+class FrameEncoder(object):
+    def __init__(self, serializer="auto"):
+        if serializer not in SERIALIZERS:
+            raise ValueError("Unknown serializer: %s" % serializer)
+        self.serializer = serializer
+
+    # The frame of a batch of records, or of a buffer.
+    def encode(self, payload):
+        if (self.serializer == "auto" and len(payload) > 0):
+            self.serializer = _probe_serializer(payload)
+        if (self.serializer != "pickle" and _marshallable(payload)):
+            return _frame(FRAME_BINARY, marshal.dumps(payload))
+        return _frame(FRAME_PICKLE,
+                      cPickle.dumps(payload, cPickle.HIGHEST_PROTOCOL))
+
+    # The frames of a sequence of batches.
+    def encode_all(self, payloads):
+        return "".join(self.encode(payload) for payload in payloads)
+
+def _frame(kind, data):
+    return _FRAME_HEADER.pack(len(data), kind) + data
+
+# Choose between the binary and pickle serializers for a stream of frames
+# from the first SERIALIZER_PROBE_RECORDS records of its first batch, or the
+# first SERIALIZER_PROBE_VALUES values of the keys of its first buffer (see
+# _probe_sample). The sample is written and read back in both forms, and
+# binary is chosen when it takes less time (with the check of its types) and
+# is not too large.
+def _probe_serializer(payload):
+    if isinstance(payload, dict):
+        sample = _probe_sample(payload)
+    else:
+        sample = payload[:SERIALIZER_PROBE_RECORDS]
+    start = timeit.default_timer()
+    if not _marshallable(sample):
+        return "pickle"
+    binaryData = marshal.dumps(sample)
+    marshal.loads(binaryData)
+    binarySeconds = timeit.default_timer() - start
+    start = timeit.default_timer()
+    pickleData = cPickle.dumps(sample, cPickle.HIGHEST_PROTOCOL)
+    cPickle.loads(pickleData)
+    pickleSeconds = timeit.default_timer() - start
+    if (len(binaryData) > BINARY_SIZE_FACTOR * len(pickleData) or
+        binarySeconds > pickleSeconds):
+        return "pickle"
+    return "binary"
+
+# The keys of a buffer sampled by the auto serializer: the first
+# SERIALIZER_PROBE_RECORDS keys, and every other key whose first value is
+# the same object as a value of one of these keys. Values are often shared
+# between keys (the record of every pair of a recommendBooks mapper), and
+# pickle writes a shared value once while marshal writes it for every key,
+# but the keys that share a value are spread over the whole buffer. The
+# rest of the buffer is only looked at when the next SERIALIZER_PROBE_WINDOW
+# keys share some values with the first ones, and the sample holds at most
+# SERIALIZER_PROBE_RECORDS * SERIALIZER_PROBE_VALUES values.
+def _probe_sample(payload):
+    sample = {}
+    sampleIds = set()
+    numValues = 0
+    maxValues = SERIALIZER_PROBE_RECORDS * SERIALIZER_PROBE_VALUES
+    for key, values in itertools.islice(payload.iteritems(),
+                                        SERIALIZER_PROBE_RECORDS):
+        if isinstance(values, list):
+            values = values[:SERIALIZER_PROBE_VALUES]
+            sampleIds.update(id(value) for value in values
+                             if type(value) in MEMO_TYPES)
+            numValues += len(values)
+        sample[key] = values
+    if (not sampleIds or numValues >= maxValues):
+        return sample
+    # The keys whose first value is one of these values, found by C code.
+    firstIds = itertools.imap(id, itertools.imap(next, itertools.imap(
+        iter, payload.itervalues())))
+    shared = itertools.islice(itertools.imap(sampleIds.__contains__,
+                                             firstIds),
+                              SERIALIZER_PROBE_RECORDS, None)
+    keys = itertools.islice(payload.iterkeys(), SERIALIZER_PROBE_RECORDS,
+                            None)
+    sharedKeys = list(itertools.compress(
+        itertools.islice(keys, SERIALIZER_PROBE_WINDOW), shared))
+    if sharedKeys:
+        sharedKeys = itertools.chain(sharedKeys,
+                                     itertools.compress(keys, shared))
+    for key in sharedKeys:
+        values = _values_list(payload[key])[:SERIALIZER_PROBE_VALUES]
+        sample[key] = values
+        numValues += len(values)
+        if (numValues >= maxValues):
+            break
+    return sample
+
+# True if every value in a payload has one of the MARSHAL_TYPES. The values
+# are checked one level of containers at a time: the types of a level are
+# collected by C code (imap), and the level is walked again only when it
+# holds containers.
+def _marshallable(payload):
+    if type(payload) not in MARSHAL_CONTAINERS:
+        return type(payload) in MARSHAL_TYPES
+    containers = [payload]
+    for depth in xrange(MARSHAL_MAX_DEPTH):
+        valueTypes = set(itertools.imap(type, _contained_values(containers)))
+        if not MARSHAL_TYPES.issuperset(valueTypes):
+            return False
+        if valueTypes.isdisjoint(MARSHAL_CONTAINERS):
+            return True
+        containers = [value for value in _contained_values(containers)
+                      if type(value) in MARSHAL_CONTAINERS]
+    return False
+
+# The items of the sequences in 'containers', and the keys and values of the
+# dicts.
+def _contained_values(containers):
+    values = itertools.chain.from_iterable(containers)
+    dicts = [container for container in containers
+             if type(container) is dict]
+    if dicts:
+        values = itertools.chain(values, itertools.chain.from_iterable(
+            container.itervalues() for container in dicts))
+    return values
+
+# Generate the payloads of the frames in data[start:end]. data is a str, a
+# buffer or a memory map.
+def decode_frames(data, start=0, end=None):
+    if end is None:
+        end = len(data)
+    headerSize = _FRAME_HEADER.size
+    position = start
+    while (position < end):
+        length, kind = _FRAME_HEADER.unpack_from(data, position)
+        payload = buffer(data, position + headerSize, length)
+        if (kind == FRAME_BINARY):
+            yield marshal.loads(payload)
         else:
-            for item in self.result:
-                print item
-    
-    
\ No newline at end of file
+            yield cPickle.load(cStringIO.StringIO(payload))
+        position += headerSize + length
+
+# The payload of a single frame.
+def decode_frame(data):
+    return next(decode_frames(data))
+
+# Generate the payloads of the frames in the byte range [start, end) of a
+# file, read through a memory map of the file.
+def _file_frames(path, start=0, end=None):
+    data = open(path, "rb")
+    try:
+        if (os.fstat(data.fileno()).st_size == 0):
+            return
+        mappedFile = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        data.close()
+    try:
+        for payload in decode_frames(mappedFile, start, end):
+            yield payload
+    finally:
+        mappedFile.close()
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Map output cache
+#
+# The cache keeps the intermediate data produced by mapping every input file
+# (after the combiner, if the job has one) in an entry file of its own. The
+# name of the entry is a hash of:
+#   - the path and size of the input file, and either its modification time
+#     or, with cacheKey "content", a hash of its contents.
+#   - a fingerprint of the job: the code of the mapper, the combiner and the
+#     functions of their modules that they call, the plain data globals that
+#     they can read (see _job_context), the file format and the settings
+#     that change the intermediate data.
+#   - the version of the marshal module, which writes the binary frames
+#     (see Serialization) the buffers are stored in.
+# A file that changed, or a job whose code changed, gets a new entry. Old
+# entries are not removed: the cache directory can be emptied at any time.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class MapOutputCache(object):
+    CACHE_KEYS = ("mtime", "content")
+
+    def __init__(self, cacheDir, jobFingerprint, cacheKey="mtime",
+                 serializer="auto"):
+        if cacheKey not in self.CACHE_KEYS:
+            raise ValueError("Unknown cache key: %s" % cacheKey)
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        self.cacheDir = cacheDir
+        self.jobFingerprint = jobFingerprint
+        self.cacheKey = cacheKey
+        self.serializer = serializer
+
+    def entry_path(self, fileName):
+        fileStat = os.stat(fileName)
+        digest = hashlib.sha1(self.jobFingerprint)
+        digest.update("marshal %d" % marshal.version)
+        digest.update(repr((os.path.abspath(fileName), fileStat.st_size)))
+        if (self.cacheKey == "content"):
+            data = open(fileName, "rb")
+            try:
+                for block in iter(lambda: data.read(1024 * 1024), ""):
+                    digest.update(block)
+            finally:
+                data.close()
+        else:
+            digest.update(repr(fileStat.st_mtime))
+        return os.path.join(self.cacheDir, digest.hexdigest() + ".map")
+
+    # Generate the buffers of intermediate data stored in an entry.
+    def read_entry(self, entryPath):
+        return _file_frames(entryPath)
+
+    def new_entry(self, entryPath):
+        return _CacheEntry(entryPath, self.serializer)
+
+# An entry is written to a temporary file that is renamed when the entry
+# is complete, so a job that fails never leaves a partial entry behind.
+class _CacheEntry(object):
+    def __init__(self, entryPath, serializer="auto"):
+        self.entryPath = entryPath
+        fd, self.tempPath = tempfile.mkstemp(prefix="mapred-", suffix=".tmp",
+                                             dir=os.path.dirname(entryPath))
+        self.entryFile = os.fdopen(fd, "wb")
+        self.encoder = FrameEncoder(serializer)
+
+    def write(self, buffer):
+        self.entryFile.write(self.encoder.encode(buffer))
+
+    # Store a buffer that is already encoded as a frame.
+    def write_frame(self, frame):
+        self.entryFile.write(frame)
+
+    def commit(self):
+        self.entryFile.close()
+        os.rename(self.tempPath, self.entryPath)
+
+    # Remove the entry if it was not committed.
+    def discard(self):
+        if not self.entryFile.closed:
+            self.entryFile.close()
+            os.remove(self.tempPath)
+
+def _job_fingerprint(functions, *settings):
+    digest = hashlib.sha1(repr(settings))
+    seen = set()
+    for function in _script_functions(functions):
+        _add_function(function, digest, seen)
+    context = _job_context(*functions)
+    digest.update(repr(sorted(context.items())))
+    return digest.hexdigest()
+
+# Add the code of a function, and of the functions of its module that it
+# calls, to a fingerprint. Callables without code (for ex: builtins) are
+# added by their repr.
+def _add_function(function, digest, seen):
+    if function in seen:
+        return
+    seen.add(function)
+    code = getattr(function, "__code__", None)
+    if code is None:
+        digest.update(repr(function))
+        return
+    digest.update(repr(function.__defaults__))
+    for codeObject in _code_objects(code):
+        digest.update(codeObject.co_code)
+        digest.update(repr(codeObject.co_names))
+        digest.update(repr([const for const in codeObject.co_consts
+                            if not isinstance(const, types.CodeType)]))
+        for name in codeObject.co_names:
+            value = function.__globals__.get(name)
+            if isinstance(value, types.FunctionType):
+                _add_function(value, digest, seen)
+
+# A code object and the code objects nested in it (lambdas, generator
+# expressions and inner functions).
+def _code_objects(code):
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            for nested in _code_objects(const):
+                yield nested
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Job statistics
+#
+# JobStats collects the statistics of one execute() call:
+#   wall, cpu         - Wall clock and CPU seconds of every phase in PHASES.
+#                       The CPU time includes the time of the worker
+#                       processes. Reading and mapping are interleaved: the
+#                       time of the map loop is split between the two in
+#                       proportion to the time spent reading the records.
+#   records           - Number of input records read, with the records
+#                       that did not match the filter (where).
+#   filteredRecords   - Number of records that did not match the filter.
+#   intermediatePairs - Number of (key, value) pairs emitted by the mappers.
+#   intermediateKeys  - Number of distinct intermediate keys.
+#   keySizes          - Number of values of every key passed to a reducer.
+#   topKeys           - The TOP_KEYS keys with the most values.
+#   hotKeys           - (key, estimated number of emitted pairs) of the hot
+#                       keys.
+#   saltedKeys        - Number of hot keys that were salted.
+#   cachedFiles       - Number of input files whose map output was read from
+#                       the map output cache.
+#   skippedRecords    - Number of bad records skipped (skip_bad_records).
+#   retriedTasks      - Number of tasks that were run again after a failure.
+#   timedOutTasks     - Number of task runs that timed out.
+#   speculativeTasks  - Number of speculative copies of tasks started.
+#   results           - Number of results written to the output.
+#   peakMemoryKB      - Peak resident memory of the main process and of the
+#                       worker processes.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class JobStats(object):
+    PHASES = ("read", "map", "shuffle", "reduce", "output")
+
+    def __init__(self):
+        self.wall = dict.fromkeys(self.PHASES, 0.0)
+        self.cpu = dict.fromkeys(self.PHASES, 0.0)
+        self.records = 0
+        self.filteredRecords = 0
+        self.intermediatePairs = 0
+        self.intermediateKeys = 0
+        self.spillRuns = 0
+        self.results = 0
+        self.keySizes = array.array("l")
+        self.topKeys = []
+        self.hotKeys = []
+        self.saltedKeys = 0
+        self.cachedFiles = 0
+        self.skippedRecords = 0
+        self.retriedTasks = 0
+        self.timedOutTasks = 0
+        self.speculativeTasks = 0
+        self.peakMemoryKB = None
+        self.workerPeakMemoryKB = None
+        # Seconds spent reading records and calling the mapper, used to
+        # split the time of the map loop.
+        self.readSeconds = 0.0
+        self.mapSeconds = 0.0
+        # Estimated number of pairs emitted for the keys sampled in the map
+        # tasks, used to find the hot keys.
+        self.keyCounts = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        startWall, startCpu = _clock()
+        try:
+            yield
+        finally:
+            endWall, endCpu = _clock()
+            self.wall[name] += endWall - startWall
+            self.cpu[name] += endCpu - startCpu
+
+    # Subtract the time of phase 'inner' from phase 'outer' when 'inner'
+    # ran inside 'outer'.
+    def remove_time(self, outer, inner):
+        self.wall[outer] = max(0.0, self.wall[outer] - self.wall[inner])
+        self.cpu[outer] = max(0.0, self.cpu[outer] - self.cpu[inner])
+
+    # Split the time measured for the map phase into read and map time.
+    def split_map_phase(self):
+        if (self.readSeconds <= 0):
+            return
+        if (self.mapSeconds <= 0):
+            # The serial path does not time the mapper separately.
+            self.mapSeconds = max(0.0, self.wall["map"] - self.readSeconds)
+        readShare = self.readSeconds / (self.readSeconds + self.mapSeconds)
+        for times in (self.wall, self.cpu):
+            times["read"] += times["map"] * readShare
+            times["map"] -= times["map"] * readShare
+
+    def add_key(self, key, numValues):
+        self.intermediateKeys += 1
+        self.keySizes.append(numValues)
+        self._add_top_key(key, numValues)
+
+    # Add the (count, key) sample of a map task. The sample counts the
+    # first samplePairs of the numPairs pairs emitted by the task.
+    def add_key_sample(self, sample, numPairs, samplePairs):
+        for count, key in sample:
+            self.keyCounts[key] = (self.keyCounts.get(key, 0) +
+                                   count * numPairs // samplePairs)
+
+    def _add_top_key(self, key, numValues):
+        if (len(self.topKeys) < TOP_KEYS):
+            heapq.heappush(self.topKeys, (numValues, key))
+        elif (numValues > self.topKeys[0][0]):
+            heapq.heapreplace(self.topKeys, (numValues, key))
+
+    # Add the statistics of a task run by a worker process.
+    def merge(self, other):
+        for name in self.PHASES:
+            self.cpu[name] += other.cpu[name]
+        self.records += other.records
+        self.filteredRecords += other.filteredRecords
+        self.skippedRecords += other.skippedRecords
+        self.intermediatePairs += other.intermediatePairs
+        self.readSeconds += other.readSeconds
+        self.mapSeconds += other.mapSeconds
+        self.results += other.results
+        self.intermediateKeys += other.intermediateKeys
+        self.keySizes.extend(other.keySizes)
+        for numValues, key in other.topKeys:
+            self._add_top_key(key, numValues)
+        for key, count in other.keyCounts.iteritems():
+            self.keyCounts[key] = self.keyCounts.get(key, 0) + count
+
+    def record_memory(self):
+        if resource is None:
+            return
+        # ru_maxrss is in bytes on Mac OS X and in kilobytes elsewhere.
+        scale = 1024 if sys.platform == "darwin" else 1
+        self.peakMemoryKB = (resource.getrusage(resource.RUSAGE_SELF)
+                             .ru_maxrss / scale)
+        self.workerPeakMemoryKB = (resource.getrusage(resource.RUSAGE_CHILDREN)
+                                   .ru_maxrss / scale)
+
+    # Number of values per key at the given percentiles.
+    def key_size_percentiles(self, percentiles=(50, 90, 99, 100)):
+        keySizes = sorted(self.keySizes)
+        if not keySizes:
+            return dict((p, 0) for p in percentiles)
+        return dict((p, keySizes[min(len(keySizes) - 1,
+                                     len(keySizes) * p / 100)])
+                    for p in percentiles)
+
+    def records_per_second(self):
+        seconds = self.wall["read"] + self.wall["map"]
+        if (seconds <= 0):
+            return 0.0
+        return self.records / seconds
+
+    def as_dict(self):
+        percentiles = self.key_size_percentiles()
+        return {
+            "wallSeconds"       : self.wall,
+            "cpuSeconds"        : self.cpu,
+            "records"           : self.records,
+            "filteredRecords"   : self.filteredRecords,
+            "recordsPerSecond"  : self.records_per_second(),
+            "intermediatePairs" : self.intermediatePairs,
+            "intermediateKeys"  : self.intermediateKeys,
+            "valuesPerKey"      : dict(("p%d" % p, percentiles[p])
+                                       for p in percentiles),
+            "topKeys"           : [[_key_name(key), numValues] for
+                                   numValues, key in
+                                   sorted(self.topKeys, reverse=True)],
+            "hotKeys"           : [[_key_name(key), numValues] for
+                                   key, numValues in self.hotKeys],
+            "saltedKeys"        : self.saltedKeys,
+            "cachedFiles"       : self.cachedFiles,
+            "skippedRecords"    : self.skippedRecords,
+            "retriedTasks"      : self.retriedTasks,
+            "timedOutTasks"     : self.timedOutTasks,
+            "speculativeTasks"  : self.speculativeTasks,
+            "spillRuns"         : self.spillRuns,
+            "results"           : self.results,
+            "peakMemoryKB"      : self.peakMemoryKB,
+            "workerPeakMemoryKB": self.workerPeakMemoryKB,
+        }
+
+    def __str__(self):
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+# Wall clock and CPU (user + system) time of this process.
+def _clock():
+    times = os.times()
+    return (time.time(), times[0] + times[1])
+
+def _key_name(key):
+    if isinstance(key, basestring):
+        return key
+    return repr(key)
+
+# Generate the records of 'records' while counting them and timing how long
+# it takes to read them. Bad records left by the reader, and the counts of
+# the records that it filtered out, are counted and dropped.
+def _timed_records(records, stats):
+    clock = time.time
+    numRecords = 0
+    numFiltered = 0
+    readSeconds = 0.0
+    records = iter(records)
+    try:
+        while True:
+            start = clock()
+            try:
+                record = next(records)
+            finally:
+                readSeconds += clock() - start
+            if (type(record) is _DroppedRecords):
+                if record is _BAD_RECORD:
+                    stats.skippedRecords += 1
+                numFiltered += record.filtered
+                continue
+            numRecords += 1
+            yield record
+    except StopIteration:
+        return
+    finally:
+        stats.records += numRecords + numFiltered
+        stats.filteredRecords += numFiltered
+        stats.readSeconds += readSeconds
+
+# Calls the mapper, and counts and skips the records (or batches of records)
+# for which the mapper raises an exception.
+class _SkippingMapper(object):
+    def __init__(self, mapper, stats):
+        self.mapper = mapper
+        self.stats = stats
+        self.isGenerator = _is_generator(mapper)
+
+    def __call__(self, key, record):
+        try:
+            if self.isGenerator:
+                # The pairs of a record are only kept if the record maps.
+                return list(self.mapper(key, record))
+            self.mapper(key, record)
+        except Exception:
+            self.stats.skippedRecords += 1
+            if self.isGenerator:
+                return ()
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Compact intermediate storage
+#
+# CompactValues holds the values emitted for one key. While every value is
+# equal to the first one (for ex: the 1s emitted by a word count) only the
+# value and a count are stored. After that, int and float values are kept
+# in a typed array and any other values in a list. Values are stored by
+# reference, so a record emitted for many keys is not copied.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+_ARRAY_TYPECODES = {int: "l", float: "d"}
+
+class CompactValues(object):
+    __slots__ = ("values", "runValue", "runCount")
+
+    def __init__(self):
+        # values is None while all the values are equal to runValue.
+        self.values = None
+        self.runValue = None
+        self.runCount = 0
+
+    def append(self, value):
+        values = self.values
+        if values is None:
+            if (self.runCount == 0):
+                self.runValue = value
+                self.runCount = 1
+                return
+            if (type(value) is type(self.runValue) and
+                value == self.runValue):
+                self.runCount += 1
+                return
+            values = self._end_run()
+        if (type(values) is list):
+            values.append(value)
+        elif (_ARRAY_TYPECODES.get(type(value)) == values.typecode):
+            values.append(value)
+        else:
+            self.values = values.tolist()
+            self.values.append(value)
+
+    def extend(self, other):
+        if (isinstance(other, CompactValues) and other.values is None):
+            if (other.runCount == 0):
+                return
+            if (self.values is None and
+                (self.runCount == 0 or
+                 (type(other.runValue) is type(self.runValue) and
+                  other.runValue == self.runValue))):
+                self.runValue = other.runValue
+                self.runCount += other.runCount
+                return
+        for value in other:
+            self.append(value)
+
+    # Store the run of equal values in a typed array or a list.
+    def _end_run(self):
+        typecode = _ARRAY_TYPECODES.get(type(self.runValue))
+        if typecode is not None:
+            self.values = array.array(typecode, [self.runValue])
+            self.values *= self.runCount
+        else:
+            self.values = [self.runValue] * self.runCount
+        self.runValue = None
+        self.runCount = 0
+        return self.values
+
+    def tolist(self):
+        if self.values is None:
+            return [self.runValue] * self.runCount
+        if (type(self.values) is list):
+            return self.values
+        return self.values.tolist()
+
+    # The distinct value objects held, for estimating the size of the store.
+    def objects(self):
+        if self.values is None:
+            return [self.runValue][:self.runCount]
+        if (type(self.values) is list):
+            return self.values
+        return []
+
+    def __len__(self):
+        if self.values is None:
+            return self.runCount
+        return len(self.values)
+
+    def __iter__(self):
+        if self.values is None:
+            return itertools.repeat(self.runValue, self.runCount)
+        return iter(self.values)
+
+    def __sizeof__(self):
+        size = object.__sizeof__(self)
+        if self.values is not None:
+            size += sys.getsizeof(self.values)
+        return size
+
+    def __getstate__(self):
+        values = self.values
+        if (values is not None and type(values) is not list):
+            values = (values.typecode, values.tostring())
+        return (values, self.runValue, self.runCount)
+
+    def __setstate__(self, state):
+        values, self.runValue, self.runCount = state
+        if (type(values) is tuple):
+            typecode, data = values
+            values = array.array(typecode)
+            values.fromstring(data)
+        self.values = values
+
+# The list of values of a key as it is passed to the reducer.
+def _values_list(values):
+    if isinstance(values, CompactValues):
+        return values.tolist()
+    return values
+
+# Intern string keys, and the strings in tuple keys, so that equal keys
+# emitted by different records share one string object.
+def _intern_key(key):
+    if (type(key) is str):
+        return intern(key)
+    if (type(key) is tuple):
+        return tuple([intern(part) if type(part) is str else part
+                      for part in key])
+    return key
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Input formats
+#
+# The fileFormat argument of execute() is the name of an input format in
+# INPUT_FORMATS. An input format is a class whose read() method generates
+# the records of one input file in the form expected by the mapper. New
+# formats are added with register_input_format().
+#
+# Formats with one record per line are splittable: read(fileName, start, end)
+# generates only the records of the lines that start in the byte range
+# [start, end) of the file, so that a large file can be mapped in parallel.
+#
+# Input files compressed with gzip, bz2 or xz are recognised by their
+# extension or by their first bytes and are decompressed as they are read.
+# A compressed file cannot be split: the parallel map phase maps each one in
+# a single worker process.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class InputFormat(object):
+    # True for formats whose records are expensive to build (for ex: decoded
+    # images). The parallel map phase lets the worker that maps such a file
+    # read it, instead of reading it in the main process.
+    readInWorker = False
+
+    # True for formats that can read a byte range of a file.
+    splittable = False
+
+    # Read the file through a memory map (line based formats).
+    useMmap = False
+
+    # Generate _BAD_RECORD in place of a record that cannot be parsed,
+    # instead of raising an exception.
+    skipBadRecords = False
+
+    # True for formats that read only the columns given by execute(...,
+    # columns=...), which are then in self.columns.
+    namedColumns = False
+    columns = None
+
+    # True for formats that apply the filter given by execute(...,
+    # where=...), which is then in self.where.
+    filtersRecords = False
+    where = None
+
+    def read(self, fileName, start=0, end=None):
+        raise NotImplementedError
+
+# Generated by a reader in place of records that it drops: 'filtered'
+# records that did not match the filter (where), counted by the job
+# statistics as records read.
+class _DroppedRecords(object):
+    __slots__ = ("filtered",)
+
+    def __init__(self, filtered):
+        self.filtered = filtered
+
+# Generated by a reader with skipBadRecords in place of a bad record.
+_BAD_RECORD = _DroppedRecords(0)
+
+# Generate the lines of a file that start in the byte range [start, end).
+# A line that starts before 'start' belongs to the previous range.
+def _read_lines(fileName, start=0, end=None, useMmap=False):
+    if _compression(fileName) is not None:
+        return _block_lines(_decompressed_blocks(fileName))
+    if useMmap:
+        return _mmap_lines(fileName, start, end)
+    return _file_lines(fileName, start, end)
+
+def _file_lines(fileName, start, end):
+    if (start == 0 and end is None):
+        data = open(fileName)
+        for line in data:
+            yield line
+        return
+    data = open(fileName, "rb")
+    if (start > 0):
+        data.seek(start - 1)
+        data.readline()
+    position = data.tell()
+    while (end is None or position < end):
+        line = data.readline()
+        if not line:
+            break
+        position += len(line)
+        yield line
+
+# The lines are read straight from the pages of the file in the operating
+# system's cache. Worker processes that read splits of one file share these
+# pages instead of each filling its own file buffer.
+def _mmap_lines(fileName, start, end):
+    data = open(fileName, "rb")
+    try:
+        fileSize = os.fstat(data.fileno()).st_size
+        if (fileSize == 0):
+            return
+        mappedFile = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        data.close()
+    try:
+        if (end is None or end > fileSize):
+            end = fileSize
+        position = start
+        if (start > 0):
+            position = mappedFile.find("\n", start - 1) + 1
+            if (position == 0):
+                return
+        mappedFile.seek(position)
+        readline = mappedFile.readline
+        while (position < end):
+            line = readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+    finally:
+        mappedFile.close()
+
+_COMPRESSED_EXTENSIONS = {
+    ".gz"  : "gzip",
+    ".bz2" : "bz2",
+    ".xz"  : "xz",
+}
+
+# Magic bytes at the start of a compressed file. The bz2 header is followed
+# by the block size and the magic number of the first block.
+_COMPRESSED_HEADERS = [
+    ("gzip", "\x1f\x8b\x08"),
+    ("xz", "\xfd7zXZ\x00"),
+]
+
+# Return the compression of a file ("gzip", "bz2" or "xz"), or None if the
+# file is not compressed.
+def _compression(fileName):
+    extension = os.path.splitext(fileName)[1].lower()
+    if extension in _COMPRESSED_EXTENSIONS:
+        return _COMPRESSED_EXTENSIONS[extension]
+    data = open(fileName, "rb")
+    header = data.read(10)
+    data.close()
+    for compression, magic in _COMPRESSED_HEADERS:
+        if header.startswith(magic):
+            return compression
+    if (header[:3] == "BZh" and header[3:4].isdigit() and
+        header[4:] == "\x31\x41\x59\x26\x53\x59"):
+        return "bz2"
+    return None
+
+def _decompressor(compression):
+    if (compression == "gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if (compression == "bz2"):
+        return bz2.BZ2Decompressor()
+    if lzma is None:
+        raise ImportError("xz compressed input files require the lzma "
+                          "module (backports.lzma on Python 2)")
+    return lzma.LZMADecompressor()
+
+# Generate the decompressed data of a file in blocks. Files made of several
+# compressed streams (gzip members, or bz2 streams written by pbzip2) are
+# read to the end: the data left over by a stream starts the next one. A
+# stream can also end with a block read from the file, and the bz2 and xz
+# decompressors then raise EOFError for the data after it.
+def _decompressed_blocks(fileName):
+    compression = _compression(fileName)
+    data = open(fileName, "rb")
+    try:
+        decompressor = _decompressor(compression)
+        while True:
+            compressed = data.read(COMPRESSED_BLOCK_SIZE)
+            if not compressed:
+                break
+            while compressed:
+                try:
+                    block = decompressor.decompress(compressed)
+                except EOFError:
+                    decompressor = _decompressor(compression)
+                    continue
+                if block:
+                    yield block
+                compressed = decompressor.unused_data
+                if compressed:
+                    decompressor = _decompressor(compression)
+    finally:
+        data.close()
+
+# Generate the lines of the blocks of data of a file.
+def _block_lines(blocks):
+    pending = ""
+    for block in blocks:
+        lines = block.split("\n")
+        lines[0] = pending + lines[0]
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+# A read-only file object over the blocks of data of a file, for readers
+# that take a file object (for ex: ET.iterparse).
+# A read takes its data from the current block at a read offset, so a block
+# is not copied again by every small read.
+class _BlockFile(object):
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.block = ""
+        self.offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        while (size != 0):
+            if (self.offset == len(self.block)):
+                self.block = next(self.blocks, "")
+                self.offset = 0
+                if not self.block:
+                    break
+            end = len(self.block)
+            if (size > 0):
+                end = min(end, self.offset + size)
+                size -= end - self.offset
+            parts.append(self.block[self.offset:end])
+            self.offset = end
+        return "".join(parts)
+
+# Open an input file for reading, decompressing it if it is compressed.
+def _open_input(fileName):
+    if _compression(fileName) is None:
+        return open(fileName, "rb")
+    return _BlockFile(_decompressed_blocks(fileName))
+
+class JsonInput(InputFormat):
+    splittable = True
+    filtersRecords = True
+
+    def read(self, fileName, start=0, end=None):
+        records = self._read(fileName, start, end)
+        where = _file_option(self.where, fileName)
+        if where is None:
+            return records
+        return _filter_records(records, _compile_filter(where, _key_field))
+
+    def _read(self, fileName, start, end):
+        for line in _read_lines(fileName, start, end, self.useMmap):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if not self.skipBadRecords:
+                    raise
+                record = _BAD_RECORD
+            yield record
+
+# Fields of a CSV file that contain line breaks cannot be read from a split
+# that starts or ends inside them.
+class CsvInput(InputFormat):
+    splittable = True
+    skipFirstLine = False
+    filtersRecords = True
+
+    def read(self, fileName, start=0, end=None):
+        records = self._read(fileName, start, end)
+        where = _file_option(self.where, fileName)
+        if where is None:
+            return records
+        return _filter_records(records, _compile_filter(where, _list_field))
+
+    def _read(self, fileName, start, end):
+        csvReader = csv.reader(_read_lines(fileName, start, end,
+                                           self.useMmap),
+                               delimiter=',')
+        # Only the split at the start of the file has the header line
+        if (self.skipFirstLine and start == 0):
+            next(csvReader, None)
+        if not self.skipBadRecords:
+            for line in csvReader:
+                yield line
+            return
+        # The reader goes on with the next line after an error.
+        while True:
+            try:
+                line = next(csvReader)
+            except StopIteration:
+                return
+            except csv.Error:
+                line = _BAD_RECORD
+            yield line
+
+class CsvSkipFirstLineInput(CsvInput):
+    skipFirstLine = True
+
+# CSV-Header reads the column names from the first line of the file, so the
+# mapper does not need to. Every row is passed to the mapper as a CsvRecord
+# of the columns given by execute(..., columns=...) (all the columns when
+# none are given). The lines are read in batches of CSV_BATCH_LINES. In a
+# batch without quotes, the fields of every line are split with str.split
+# only as far as the last column needed, and the records are made without a
+# Python call per line. Other batches are parsed line by line, with the csv
+# module for the lines with quotes. Fields missing at the end of a short
+# row are read as empty strings, like the fields of missing attributes
+# written by XmlToCsv.py. Empty lines are skipped.
+#
+# A filter (execute(..., where=...)) is applied to the fields of a row
+# before its record is made. A batch without quotes is first narrowed to the
+# lines that contain the text that a column compared with "==" to a string
+# must have (for ex: ",1," for the middle column PostTypeId == "1"), so
+# most lines that do not match are not split at all. Lines with fewer
+# fields than the header are kept for the filter, since a missing field
+# changes the text around the value.
+class CsvHeaderInput(InputFormat):
+    splittable = True
+    namedColumns = True
+    filtersRecords = True
+
+    def read(self, fileName, start=0, end=None):
+        header = _csv_header(fileName)
+        columns = _file_option(self.columns, fileName)
+        if columns is None:
+            columns = header
+        indexes = [_column_index(header, column, fileName)
+                   for column in columns]
+        names = [header[index] for index in indexes]
+        numFields = max(indexes) + 1 if indexes else 0
+        where = _file_option(self.where, fileName)
+        # predicate(row) tells whether a row matches the filter, and
+        # select(rows) gives the rows of a list that match.
+        predicate = None
+        select = None
+        needles = []
+        if where is not None:
+            filterIndexes = []
+            def field(column):
+                index = _column_index(header, column, fileName)
+                filterIndexes.append(index)
+                return operator.itemgetter(index)
+            predicate = _compile_filter(where, field)
+            select = lambda rows: filter(predicate, rows)
+            numFields = max([numFields] + [index + 1 for index in
+                                           filterIndexes])
+            needles = _filter_needles(where, lambda column, value:
+                _csv_needle(_column_index(header, column, fileName),
+                            len(header), value))
+            equalities = _filter_equalities(where)
+            if equalities:
+                # The fields compared are taken from a row in one call and
+                # compared as a tuple, without a Python call per row.
+                getter = operator.itemgetter(*[
+                    _column_index(header, column, fileName)
+                    for column, value in equalities])
+                values = tuple(value for column, value in equalities)
+                if (len(values) == 1):
+                    values = values[0]
+                predicate = lambda row: getter(row) == values
+                select = lambda rows: [row for row in rows
+                                       if getter(row) == values]
+        lines = _read_lines(fileName, start, end, self.useMmap)
+        # Only the split at the start of the file has the header line
+        if (start == 0):
+            next(lines, None)
+        return itertools.chain.from_iterable(
+            self._record_batches(lines, _csv_record_class(tuple(names)),
+                                 indexes, numFields, predicate, select,
+                                 needles, len(header)))
+
+    def _record_batches(self, lines, recordClass, indexes, numFields,
+                        predicate, select, needles, numColumns):
+        if (len(indexes) > 1):
+            project = operator.itemgetter(*indexes)
+        else:
+            def project(row):
+                return tuple(row[index] for index in indexes)
+        numCommas = numColumns - 1
+        newRecord = tuple.__new__
+        repeat = itertools.repeat
+        imap = itertools.imap
+        while True:
+            batch = list(itertools.islice(lines, CSV_BATCH_LINES))
+            if not batch:
+                return
+            # An empty line is split into [""]. The itemgetter of several
+            # columns fails on it like on a short line, but one column would
+            # be read from it, so such a batch is parsed by _parse_lines,
+            # which skips the empty lines.
+            if ('"' not in "".join(batch) and
+                (len(indexes) > 1 or not _blank_lines(batch))):
+                matching = batch
+                for group in needles:
+                    if (len(group) == 1):
+                        needle = group[0]
+                        matching = [line for line in matching
+                                    if (needle in line or
+                                        line.count(",") < numCommas)]
+                    else:
+                        matching = [line for line in matching
+                                    if (any(needle in line
+                                            for needle in group) or
+                                        line.count(",") < numCommas)]
+                rows = imap(str.split, imap(str.rstrip, matching,
+                                            repeat("\r\n")),
+                            repeat(","), repeat(numFields))
+                try:
+                    if select is not None:
+                        rows = select(rows)
+                    records = list(imap(newRecord, repeat(recordClass),
+                                        map(project, rows)))
+                    if select is not None:
+                        numFiltered = (len(batch) - len(records) -
+                                       _blank_lines(batch))
+                        if numFiltered:
+                            records.append(_DroppedRecords(numFiltered))
+                    yield records
+                    continue
+                except IndexError:
+                    # A short or empty line.
+                    pass
+            yield list(self._parse_lines(batch, lines, recordClass, project,
+                                         numFields, predicate))
+
+    # The records of a batch of lines, parsed one line at a time. A quoted
+    # field may go on over the lines after the batch.
+    def _parse_lines(self, batch, lines, recordClass, project, numFields,
+                     predicate):
+        numFiltered = 0
+        batch = iter(batch)
+        for line in batch:
+            if not line.strip("\r\n"):
+                continue
+            if ('"' in line):
+                try:
+                    row = next(csv.reader(itertools.chain([line], batch,
+                                                          lines)))
+                except csv.Error:
+                    if not self.skipBadRecords:
+                        raise
+                    yield _BAD_RECORD
+                    continue
+            else:
+                row = line.rstrip("\r\n").split(",", numFields)
+            if (len(row) < numFields):
+                row.extend([""] * (numFields - len(row)))
+            if (predicate is not None and not predicate(row)):
+                numFiltered += 1
+                continue
+            yield tuple.__new__(recordClass, project(row))
+        if numFiltered:
+            yield _DroppedRecords(numFiltered)
+
+# The number of empty lines in a list of lines.
+def _blank_lines(lines):
+    return (lines.count("") + lines.count("\n") + lines.count("\r\n") +
+            lines.count("\r"))
+
+# The index of a column of a CSV file, given by name or by number.
+def _column_index(header, column, fileName):
+    if isinstance(column, (int, long)):
+        if not (0 <= column < len(header)):
+            raise ValueError("%s has no column %d" % (fileName, column))
+        return column
+    if column not in header:
+        raise ValueError("%s has no column %r" % (fileName, column))
+    return header.index(column)
+
+# Text that a line of a CSV file without quotes contains when the column
+# 'index' of the numColumns columns has the given value.
+def _csv_needle(index, numColumns, value):
+    if (numColumns == 1):
+        return value
+    if (index == 0):
+        return value + ","
+    if (index == numColumns - 1):
+        return "," + value
+    return "," + value + ","
+
+# The column names of the header line of a CSV file.
+def _csv_header(fileName):
+    lines = _read_lines(fileName)
+    line = next(lines, "")
+    lines.close()
+    header = next(csv.reader([line]), [])
+    if (header and header[0].startswith(codecs.BOM_UTF8)):
+        header[0] = header[0][len(codecs.BOM_UTF8):]
+    return header
+
+# A row of a CSV-Header file: a tuple of the values of the columns read, in
+# the order they were asked for. A value can also be read by column name,
+# as an attribute (record.Title) or with record.column("Title") for names
+# that are not valid attribute names.
+class CsvRecord(tuple):
+    __slots__ = ()
+    columnNames = ()
+    columnIndex = {}
+
+    def column(self, name):
+        return self[self.columnIndex[name]]
+
+    def as_dict(self):
+        return dict(zip(self.columnNames, self))
+
+    def __repr__(self):
+        return "CsvRecord(%s)" % ", ".join("%s=%r" % item for item in
+                                           zip(self.columnNames, self))
+
+    # Records are pickled as their column names and values, since their
+    # classes are made while the file is read.
+    def __reduce__(self):
+        return (_csv_record, (self.columnNames, tuple(self)))
+
+_CSV_RECORD_CLASSES = {}
+
+# The CsvRecord class of the given column names, made once per process.
+def _csv_record_class(columnNames):
+    recordClass = _CSV_RECORD_CLASSES.get(columnNames)
+    if recordClass is not None:
+        return recordClass
+    attributes = {"__slots__": (), "columnNames": columnNames,
+                  "columnIndex": {}}
+    for index, name in enumerate(columnNames):
+        if name in attributes["columnIndex"]:
+            continue
+        attributes["columnIndex"][name] = index
+        if (_IDENTIFIER.match(name) and not name.startswith("_") and
+            not hasattr(CsvRecord, name)):
+            attributes[name] = property(operator.itemgetter(index))
+    recordClass = type("CsvRecord", (CsvRecord,), attributes)
+    _CSV_RECORD_CLASSES[columnNames] = recordClass
+    return recordClass
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*\Z")
+
+def _csv_record(columnNames, values):
+    return tuple.__new__(_csv_record_class(columnNames), values)
+
+class TextInput(InputFormat):
+    splittable = True
+
+    def read(self, fileName, start=0, end=None):
+        return _read_lines(fileName, start, end, self.useMmap)
+
+class ImageInput(InputFormat):
+    readInWorker = True
+
+    def read(self, fileName, start=0, end=None):
+        if Image is None:
+            raise ImportError("The IMAGE file format requires Pillow")
+        try:
+            imageFile = Image.open(fileName)
+            imageData = list(imageFile.getdata())
+        except (IOError, SyntaxError, ValueError):
+            # Pillow raises these for truncated and corrupt files.
+            if not self.skipBadRecords:
+                raise
+            yield _BAD_RECORD
+            return
+        mapperInput = []
+        mapperInput.append(fileName)
+        mapperInput.append(imageData)
+        yield mapperInput
+
+# SOXML is used to identify XML file dumps of StackExchange datasets.
+# In all StackExchange XML files, the main data is stored as attributes
+# of the xml element 'row'. We extract the attributes of the element as
+# a dictionary and pass that to the mapper. The mapper is responsible for
+# extracting the correct attributes from the dictionary.
+# The file is parsed as a stream of events. Every row is removed from the
+# tree once its attributes have been taken, so memory use does not grow
+# with the size of the dump.
+class SoXmlInput(InputFormat):
+    filtersRecords = True
+
+    def read(self, fileName, start=0, end=None):
+        records = self._read(fileName)
+        where = _file_option(self.where, fileName)
+        if where is None:
+            return records
+        return _filter_records(records, _compile_filter(where, _key_field))
+
+    def _read(self, fileName):
+        xmlEvents = ET.iterparse(_open_input(fileName),
+                                 events=("start", "end"))
+        event, treeRoot = next(xmlEvents)
+        for event, element in xmlEvents:
+            if (event == "end" and element.tag == "row"):
+                attrib = element.attrib
+                element.attrib = {}
+                treeRoot.clear()
+                yield attrib
+
+INPUT_FORMATS = {
+    "JSON"              : JsonInput,
+    "CSV"               : CsvInput,
+    "CSV-SkipFirstLine" : CsvSkipFirstLineInput,
+    "CSV-Header"        : CsvHeaderInput,
+    "TEXT"              : TextInput,
+    "IMAGE"             : ImageInput,
+    "SOXML"             : SoXmlInput,
+}
+
+# Make formatClass available to execute() as the file format 'name'.
+def register_input_format(name, formatClass):
+    INPUT_FORMATS[name] = formatClass
+
+# The value of a reader option for one file: options that differ between
+# the files of a job are given as a dictionary by file name.
+def _file_option(option, fileName):
+    if isinstance(option, dict):
+        return option.get(fileName)
+    return option
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Filters
+#
+# A filter selects the records of the input that are passed to the mapper.
+# It is either a comparison of a column with a constant:
+#   (column, op, constant)            op is one of FILTER_OPERATORS
+# or a combination of filters:
+#   ("and", filter, filter, ...)
+#   ("or", filter, filter, ...)
+# Columns are column names (CSV-Header), column numbers (CSV and
+# CSV-SkipFirstLine) or keys of the records (JSON objects and the rows of
+# SOXML files). An int or float constant is compared with the value of the
+# column as a number, and values that are not numbers do not match, like
+# NULL in SQL. Other constants are compared with the value as it is. A
+# record without the column does not match.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+FILTER_OPERATORS = {
+    "==" : operator.eq,
+    "!=" : operator.ne,
+    "<"  : operator.lt,
+    "<=" : operator.le,
+    ">"  : operator.gt,
+    ">=" : operator.ge,
+}
+
+# Compile a filter into a function record -> bool. field(column) returns a
+# function that gets the value of the column from a record, or None.
+def _compile_filter(where, field):
+    if not isinstance(where, (tuple, list)) or not where:
+        raise ValueError("Bad filter: %r" % (where,))
+    if where[0] in ("and", "or"):
+        if (len(where) < 2):
+            raise ValueError("Bad filter: %r" % (where,))
+        parts = [_compile_filter(part, field) for part in where[1:]]
+        combine = _both if where[0] == "and" else _either
+        return reduce(combine, parts)
+    if (len(where) != 3 or where[1] not in FILTER_OPERATORS):
+        raise ValueError("Bad filter: %r" % (where,))
+    column, op, constant = where
+    compare = FILTER_OPERATORS[op]
+    get = field(column)
+    if (isinstance(constant, (int, long, float)) and
+        not isinstance(constant, bool)):
+        def matches(record):
+            try:
+                return compare(float(get(record)), constant)
+            except (TypeError, ValueError):
+                return False
+        return matches
+    def matches(record):
+        value = get(record)
+        return value is not None and compare(value, constant)
+    return matches
+
+def _both(first, second):
+    return lambda record: first(record) and second(record)
+
+def _either(first, second):
+    return lambda record: first(record) or second(record)
+
+# Fields of records that are lists (CSV rows) and dictionaries.
+def _list_field(column):
+    if not isinstance(column, (int, long)):
+        raise ValueError("Columns of CSV files are numbers: %r" % (column,))
+    return lambda record: record[column] if column < len(record) else None
+
+def _key_field(column):
+    return (lambda record: record.get(column)
+            if isinstance(record, dict) else None)
+
+# Groups of text that the line of a record that matches the filter must
+# contain: at least one text of every group. needle(column, value) is the
+# text of a line whose column has the string value. Only "==" comparisons
+# with strings give text, so a filter may give no groups.
+def _filter_needles(where, needle):
+    if (where[0] == "and"):
+        groups = []
+        for part in where[1:]:
+            groups.extend(_filter_needles(part, needle))
+        return groups
+    if (where[0] == "or"):
+        group = []
+        for part in where[1:]:
+            partGroups = _filter_needles(part, needle)
+            if not partGroups:
+                return []
+            group.extend(partGroups[0])
+        return [group]
+    column, op, constant = where
+    if (op != "==" or not isinstance(constant, str) or not constant or
+        any(char in constant for char in "\",\r\n")):
+        return []
+    return [[needle(column, constant)]]
+
+# The (column, value) pairs of a filter that is one "==" comparison with a
+# string, or the "and" of such comparisons. None for other filters.
+def _filter_equalities(where):
+    if (where[0] == "and"):
+        equalities = []
+        for part in where[1:]:
+            partEqualities = _filter_equalities(part)
+            if partEqualities is None:
+                return None
+            equalities.extend(partEqualities)
+        return equalities
+    if (where[0] == "or" or len(where) != 3):
+        return None
+    column, op, constant = where
+    if (op != "==" or not isinstance(constant, str)):
+        return None
+    return [(column, constant)]
+
+# The records that match predicate(record), and then the number of the
+# others.
+def _filter_records(records, predicate):
+    numFiltered = 0
+    for record in records:
+        if (record is _BAD_RECORD or predicate(record)):
+            yield record
+        else:
+            numFiltered += 1
+    if numFiltered:
+        yield _DroppedRecords(numFiltered)
+
+# Create the input format 'fileFormat'. readerOptions is a dictionary of
+# attributes set on the new object (for ex: {"useMmap": True}).
+def _input_format(fileFormat, readerOptions=None):
+    if fileFormat not in INPUT_FORMATS:
+        raise ValueError("Unknown file format: %s" % fileFormat)
+    inputFormat = INPUT_FORMATS[fileFormat]()
+    if (readerOptions and readerOptions.get("columns") is not None and
+        not inputFormat.namedColumns):
+        raise ValueError("The %s file format does not read columns by name"
+                         % fileFormat)
+    if (readerOptions and readerOptions.get("where") is not None and
+        not inputFormat.filtersRecords):
+        raise ValueError("The %s file format does not filter records"
+                         % fileFormat)
+    if readerOptions:
+        for name, value in readerOptions.items():
+            setattr(inputFormat, name, value)
+    return inputFormat
+
+# Generate the records of one input file, or of the byte range 'split' of
+# the file, in the form expected by the mapper.
+def _read_records(fileName, fileFormat, split=None, readerOptions=None):
+    inputFormat = _input_format(fileFormat, readerOptions)
+    if split is None:
+        return inputFormat.read(fileName)
+    start, end = split
+    return inputFormat.read(fileName, start, end)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Prefetching
+#
+# A _Prefetcher reads the records of a list of files on a background thread
+# and hands them to the mapper through a bounded queue, so that the mapper
+# does not wait while a file is read. The thread overlaps disk reads, and
+# the work of readers that release the interpreter lock (decoding images,
+# decompressing files), with the mapper. Parsing done in Python (csv,
+# json.loads) still shares the interpreter with the mapper: workers > 1 maps
+# those formats in parallel.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class _Prefetcher(object):
+    # Queue item that marks the end of the records of a file.
+    END_OF_FILE = object()
+
+    def __init__(self, fileNameList, fileFormat, readerOptions, depth):
+        self.queue = Queue.Queue(depth)
+        self.stopped = False
+        self.thread = threading.Thread(target=self._read_files,
+                                       args=(fileNameList, fileFormat,
+                                             readerOptions))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read_files(self, fileNameList, fileFormat, readerOptions):
+        try:
+            for fileName in fileNameList:
+                records = _read_records(fileName, fileFormat,
+                                        readerOptions=readerOptions)
+                for chunk in _batches(records, PREFETCH_RECORDS):
+                    if not self._put(chunk):
+                        return
+                if not self._put(self.END_OF_FILE):
+                    return
+        except BaseException:
+            # Raised again by records() in the main thread.
+            self._put(sys.exc_info())
+
+    # Put an item in the queue. Returns False if the prefetcher was closed
+    # while waiting for space in the queue.
+    def _put(self, item):
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    # Generate the records of the next file in the list.
+    def records(self):
+        while True:
+            item = self.queue.get()
+            if item is self.END_OF_FILE:
+                return
+            if isinstance(item, tuple):
+                excType, excValue, excTraceback = item
+                raise excType, excValue, excTraceback
+            for record in item:
+                yield record
+
+    def close(self):
+        self.stopped = True
+        self.thread.join()
+
+# Group records into lists of batchSize records for mappers that take a
+# batch of records per call.
+def _batches(records, batchSize):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if (len(batch) == batchSize):
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Output sinks
+#
+# The results of a job are written to an output sink. The sink receives the
+# results in lists of up to OUTPUT_BUFFER_ITEMS items and writes every list
+# to its stream in one call.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class OutputSink(object):
+    def write(self, items):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+# Keeps the results in memory, in the list self.items.
+class ListSink(OutputSink):
+    def __init__(self):
+        self.items = []
+
+    def write(self, items):
+        self.items.extend(items)
+
+# Writes the results to a file object in one of the OUTPUT_FORMATS:
+#   TEXT - str() of every result on its own line, like print.
+#   JSON - every result encoded as JSON on its own line (JSON lines).
+#   CSV  - every result as a row of comma separated values. Results that
+#          are not lists or tuples are written as a row with one column.
+#   TSV  - like CSV with tab separated values.
+class StreamSink(OutputSink):
+    def __init__(self, stream, outputFormat="TEXT", closeStream=False):
+        if outputFormat not in OUTPUT_FORMATS:
+            raise ValueError("Unknown output format: %s" % outputFormat)
+        self.stream = stream
+        self.outputFormat = outputFormat
+        self.closeStream = closeStream
+        self.jenc = json.JSONEncoder()
+        if outputFormat in ("CSV", "TSV"):
+            delimiter = "," if outputFormat == "CSV" else "\t"
+            self.csvWriter = csv.writer(stream, delimiter=delimiter,
+                                        lineterminator="\n")
+
+    def write(self, items):
+        if (self.outputFormat == "TEXT"):
+            try:
+                lines = map(str, items)
+            except UnicodeEncodeError:
+                lines = [_text_line(item) for item in items]
+            lines.append("")
+            self.stream.write("\n".join(lines))
+        elif (self.outputFormat == "JSON"):
+            self.stream.write("".join([self.jenc.encode(item) + "\n"
+                                       for item in items]))
+        else:
+            self.csvWriter.writerows([_csv_row(item) for item in items])
+
+    def close(self):
+        self.stream.flush()
+        if self.closeStream:
+            self.stream.close()
+
+OUTPUT_FORMATS = ("TEXT", "JSON", "CSV", "TSV")
+
+def _text_line(item):
+    if isinstance(item, unicode):
+        return item.encode("utf-8")
+    return str(item)
+
+def _csv_row(item):
+    if isinstance(item, (list, tuple)):
+        return item
+    return [item]
+
+def _output_sink(output, outputFormat):
+    if isinstance(output, OutputSink):
+        return output
+    if outputFormat not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format: %s" % outputFormat)
+    if output is None:
+        return StreamSink(sys.stdout, outputFormat)
+    return StreamSink(open(output, "wb"), outputFormat, closeStream=True)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Pipelines
+#
+# A Pipeline chains map/reduce stages. The results emitted by the reducer of
+# a stage are the records of the mapper of the next stage: they are handed
+# over as Python objects in a StageSink, without being written out as text
+# and parsed again.
+#
+# A stage without a reducer is a map-only stage. Its mapper emits its output
+# records with emit() and is fused with the stage after it: both mappers run
+# in the same pass over the records. Map-only stages at the end of the
+# pipeline run over the results of the last reducer as they are written.
+#
+#   pipeline = MapReduce.Pipeline(mr, workers=4)
+#   pipeline.add_stage(parse_mapper)
+#   pipeline.add_stage(join_mapper, join_reducer)
+#   pipeline.add_stage(count_mapper, count_reducer, combiner=count_combiner)
+#   pipeline.run(["Posts.xml"], "SOXML")
+#
+# The options of the Pipeline, and of a stage, are arguments of execute().
+# The options of a map-only stage are not used. Only the first stage reads
+# files, so cache_dir, columns and where are only used by the first stage.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class Pipeline(object):
+    def __init__(self, engine, **options):
+        self.engine = engine
+        self.options = options
+        self.stages = []
+
+    def add_stage(self, mapper, reducer=None, **options):
+        self.stages.append((mapper, reducer, options))
+        return self
+
+    # Run the stages over the input files. output and output_format are
+    # those of execute() and apply to the results of the last stage.
+    # Returns the JobStats of every pass over the data.
+    def run(self, fileNameList, fileFormat, output=None, output_format=None):
+        if isinstance(fileNameList, basestring):
+            fileNameList = [fileNameList]
+        if output_format is None:
+            output_format = "JSON" if fileFormat == "JSON" else "TEXT"
+        passes = self._passes()
+        allStats = []
+        try:
+            for index, (mappers, reducer, options, outputMappers) in \
+                    enumerate(passes):
+                name = self._stage_name(index)
+                if (index == len(passes) - 1):
+                    sink = _output_sink(output, output_format)
+                    if outputMappers:
+                        sink = _MappedSink(outputMappers, name, sink)
+                else:
+                    sink = StageSink(options.get("spill_dir"))
+                    _stageOutputs[name] = sink
+                if reducer is None:
+                    stats = _map_only_pass(mappers, fileNameList, fileFormat,
+                                           sink)
+                else:
+                    if (index > 0):
+                        options.pop("cache_dir", None)
+                        options.pop("columns", None)
+                        options.pop("where", None)
+                    mapper = mappers[0]
+                    if (len(mappers) > 1):
+                        mapper = _FusedMapper(mappers)
+                    stats = self.engine.execute(fileNameList, mapper, reducer,
+                                                fileFormat, output=sink,
+                                                **options)
+                allStats.append(stats)
+                # The output of the previous stage has been read.
+                if fileFormat == "PIPELINE":
+                    _stageOutputs.pop(fileNameList[0]).remove()
+                fileNameList = [name]
+                fileFormat = "PIPELINE"
+        finally:
+            for index in range(len(passes)):
+                name = self._stage_name(index)
+                if name in _stageOutputs:
+                    _stageOutputs.pop(name).remove()
+        return allStats
+
+    # Name of the output of pass 'index' in _stageOutputs.
+    def _stage_name(self, index):
+        return "pipeline-%d-stage-%d" % (id(self), index)
+
+    # Group the stages into passes of (mappers, reducer, options,
+    # outputMappers). The mappers of the map-only stages before a stage
+    # with a reducer run in its pass, and the mappers of the map-only
+    # stages at the end run over the output of the last pass.
+    def _passes(self):
+        passes = []
+        mappers = []
+        for mapper, reducer, options in self.stages:
+            mappers.append(mapper)
+            if reducer is not None:
+                passOptions = dict(self.options)
+                passOptions.update(options)
+                passes.append((mappers, reducer, passOptions, []))
+                mappers = []
+        if passes:
+            passes[-1][3].extend(mappers)
+        elif mappers:
+            passes.append((mappers, None, {}, []))
+        return passes
+
+# Keeps the results of a pipeline stage for the next stage. The first
+# HANDOFF_ITEMS results are kept in memory, the rest are appended to a run
+# file in spillDir as frames of lists (see Serialization).
+class StageSink(OutputSink):
+    def __init__(self, spillDir=None):
+        self.items = []
+        self.spillDir = spillDir
+        self.spillPath = None
+        self.spillFile = None
+        self.encoder = FrameEncoder()
+
+    def write(self, items):
+        if (self.spillFile is None and
+            len(self.items) + len(items) <= HANDOFF_ITEMS):
+            self.items.extend(items)
+            return
+        if self.spillFile is None:
+            fd, self.spillPath = tempfile.mkstemp(prefix="mapred-",
+                                                  suffix=".run",
+                                                  dir=self.spillDir)
+            self.spillFile = os.fdopen(fd, "wb")
+        self.spillFile.write(self.encoder.encode(list(items)))
+
+    def close(self):
+        if self.spillFile is not None:
+            self.spillFile.close()
+
+    def __iter__(self):
+        for item in self.items:
+            yield item
+        if self.spillPath is None:
+            return
+        for items in _file_frames(self.spillPath):
+            for item in items:
+                yield item
+
+    def remove(self):
+        self.items = []
+        if self.spillPath is not None:
+            self.close()
+            os.remove(self.spillPath)
+            self.spillPath = None
+
+# Outputs of pipeline stages that are read by the next stage, by name.
+_stageOutputs = {}
+
+# The records of the output of an earlier pipeline stage. The file name is
+# the name of the stage output.
+class PipelineInput(InputFormat):
+    def read(self, fileName, start=0, end=None):
+        return iter(_stageOutputs[fileName])
+
+register_input_format("PIPELINE", PipelineInput)
+
+# Call the mappers of map-only stages over records, in order, and return the
+# records emitted (or yielded, by generator mappers) by the last one. The
+# values emitted through any engine of this process are collected, and its
+# own results and sink are restored afterwards.
+def _map_records(mappers, key, records):
+    engines = list(_liveEngines)
+    saved = [(engine.result, engine.sink) for engine in engines]
+    try:
+        for mapper in mappers:
+            output = []
+            for engine in engines:
+                engine.result = output
+                engine.sink = None
+            if _is_generator(mapper):
+                for record in records:
+                    output.extend(mapper(key, record))
+            else:
+                for record in records:
+                    mapper(key, record)
+            records = output
+    finally:
+        for engine, (result, sink) in zip(engines, saved):
+            engine.result = result
+            engine.sink = sink
+    return records
+
+# The mapper of a pass with map-only stages: the records emitted by the
+# mappers of the map-only stages are mapped by the mapper of the stage with
+# the reducer.
+class _FusedMapper(object):
+    def __init__(self, functions):
+        self.functions = functions
+        self.isGenerator = _is_generator(functions[-1])
+
+    def __call__(self, key, record):
+        mapper = self.functions[-1]
+        mappedRecords = _map_records(self.functions[:-1], key, [record])
+        if self.isGenerator:
+            return self._pairs(mapper, key, mappedRecords)
+        for mappedRecord in mappedRecords:
+            mapper(key, mappedRecord)
+
+    def _pairs(self, mapper, key, mappedRecords):
+        for mappedRecord in mappedRecords:
+            for pair in mapper(key, mappedRecord):
+                yield pair
+
+# Runs the mappers of the map-only stages at the end of a pipeline over the
+# results written to the sink, and writes their output to the next sink.
+class _MappedSink(OutputSink):
+    def __init__(self, mappers, key, sink):
+        self.mappers = mappers
+        self.key = key
+        self.sink = sink
+
+    def write(self, items):
+        records = _map_records(self.mappers, self.key, items)
+        if records:
+            self.sink.write(records)
+
+    def close(self):
+        self.sink.close()
+
+# A pipeline made only of map-only stages runs in this process, without a
+# map/reduce pass.
+def _map_only_pass(mappers, fileNameList, fileFormat, sink):
+    stats = JobStats()
+    try:
+        with stats.phase("map"):
+            for fileName in fileNameList:
+                records = _timed_records(_read_records(fileName, fileFormat),
+                                         stats)
+                for batch in _batches(records, OUTPUT_BUFFER_ITEMS):
+                    output = _map_records(mappers, fileName, batch)
+                    if output:
+                        sink.write(output)
+                        stats.results += len(output)
+    finally:
+        sink.close()
+    stats.split_map_phase()
+    stats.record_memory()
+    return stats
+
+# The functions of the job script behind the mapper, reducer and combiner
+# of a job. A fused mapper stands for the mappers of its stages.
+def _script_functions(functions):
+    scriptFunctions = []
+    for function in functions:
+        if isinstance(function, _FusedMapper):
+            scriptFunctions.extend(function.functions)
+        elif function is not None:
+            scriptFunctions.append(function)
+    return scriptFunctions
+
+# Split the input into map tasks. A task is (fileName, fileFormat, split,
+# records). Files of splittable formats are read by the workers in byte
+# ranges of splitSize bytes. Files of formats that are read in the worker
+# (for ex: images) are one task each. Other files, and compressed files of
+# splittable formats, which cannot be split, are read here and sent to the
+# workers in chunks of RECORDS_PER_TASK records, so that the output of a
+# task stays small however large the file is.
+def _map_tasks(fileNameList, fileFormat, splitSize, readerOptions, stats):
+    inputFormat = _input_format(fileFormat, readerOptions)
+    for fileName in fileNameList:
+        if (inputFormat.splittable and _compression(fileName) is None):
+            for split in _file_splits(fileName, splitSize):
+                yield (fileName, fileFormat, split, None)
+            continue
+        if inputFormat.readInWorker:
+            yield (fileName, fileFormat, None, None)
+            continue
+        chunk = []
+        for record in _timed_records(inputFormat.read(fileName), stats):
+            chunk.append(record)
+            if (len(chunk) == RECORDS_PER_TASK):
+                yield (fileName, fileFormat, None, chunk)
+                chunk = []
+        if chunk:
+            yield (fileName, fileFormat, None, chunk)
+
+# The map tasks of the files at the given positions of fileNameList. The
+# position of the file of every task is appended to taskPositions.
+def _positioned_tasks(fileNameList, positions, fileFormat, splitSize,
+                      readerOptions, stats, taskPositions):
+    for position in positions:
+        for task in _map_tasks([fileNameList[position]], fileFormat,
+                               splitSize, readerOptions, stats):
+            taskPositions.append(position)
+            yield task
+
+# pool.imap of Python 2 reads the tasks on a thread of the pool, where an
+# exception raised by a generator of tasks is lost: the results just end,
+# without an error. The tasks are read through a _TaskReader instead, which
+# ends the tasks on an exception and raises it again here once the results
+# of the tasks before it have been generated. The tasks of a list cannot
+# fail, and _TaskScheduler reads the tasks in the calling thread.
+def _pool_imap(pool, function, tasks):
+    reader = _TaskReader(tasks)
+    for result in pool.imap(function, reader.read()):
+        yield result
+    reader.check()
+
+class _TaskReader(object):
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.excInfo = None
+
+    def read(self):
+        try:
+            for task in self.tasks:
+                yield task
+        except Exception:
+            self.excInfo = sys.exc_info()
+
+    def check(self):
+        if self.excInfo is not None:
+            excType, excValue, excTraceback = self.excInfo
+            raise excType, excValue, excTraceback
+
+# Byte ranges of splitSize bytes covering a file. The ranges are aligned to
+# line boundaries when they are read.
+def _file_splits(fileName, splitSize):
+    fileSize = os.path.getsize(fileName)
+    if (fileSize <= splitSize):
+        return [None]
+    return [(start, min(start + splitSize, fileSize))
+            for start in xrange(0, fileSize, splitSize)]
+
+# The mapper of a job often depends on globals that are filled in by main()
+# (for ex: the column names of a CSV file). Worker processes that do not fork
+# from the parent never run main(), so plain data globals are copied to them.
+_CONTEXT_TYPES = (basestring, int, long, float, bool, list, tuple, dict,
+                  set, frozenset, types.NoneType)
+
+def _job_context(*functions):
+    context = {}
+    for function in _script_functions(functions):
+        for name, value in function.__globals__.items():
+            if (not name.startswith("__") and
+                isinstance(value, _CONTEXT_TYPES)):
+                context[name] = value
+    return context
+
+# The job run by a worker process. A dictionary with the mapper, reducer,
+# combiner and batchSize of the job.
+_workerJob = None
+
+def _init_worker(job, context):
+    global _workerJob
+    _workerJob = job
+    for function in _script_functions((job["mapper"], job["reducer"],
+                                       job["combiner"])):
+        function.__globals__.update(context)
+
+def _run_map_task(task):
+    fileName, fileFormat, split, records = task
+    taskStats = JobStats()
+    startWall, startCpu = _clock()
+    if records is None:
+        records = _timed_records(_read_records(fileName, fileFormat, split,
+                                               _workerJob["readerOptions"]),
+                                 taskStats)
+    if _workerJob["batchSize"]:
+        records = _batches(records, _workerJob["batchSize"])
+    mapper = _workerJob["mapper"]
+    if _workerJob["skipBadRecords"]:
+        mapper = _SkippingMapper(mapper, taskStats)
+    combiner = _workerJob["combiner"]
+    buffer = {}
+    # A job of generator functions may have no MapReduce object of its own.
+    engines = list(_liveEngines) or [MapReduce()]
+    for engine in engines:
+        engine.intermediate = buffer
+        engine._configure(combiner, compact=_workerJob["compact"],
+                          sampleKeys=True)
+    _run_mapper(mapper, fileName, records, engines[0])
+    # The engines share the buffer, which holds every pair when they do
+    # not count them.
+    if (engines[0].bufferLimit == sys.maxint):
+        taskStats.intermediatePairs = _count_values(buffer)
+    else:
+        taskStats.intermediatePairs = sum(engine.emittedPairs +
+                                          engine.pendingPairs
+                                          for engine in engines)
+    # The buffer is sampled by the engine that filled it first.
+    sampler = next((engine for engine in engines if engine.samplePairs),
+                   engines[0])
+    sampler._add_key_sample(taskStats, taskStats.intermediatePairs)
+    if combiner is not None:
+        engines[0]._combine()
+    endWall, endCpu = _clock()
+    taskStats.mapSeconds = endWall - startWall - taskStats.readSeconds
+    taskStats.cpu["map"] = endCpu - startCpu
+    return (buffer, taskStats)
+
+# A map task run by a worker process of the pool. The buffer is returned as
+# a frame (see Serialization), which the main process decodes and stores in
+# the cache as it is.
+def _run_pool_map_task(task):
+    buffer, taskStats = _run_map_task(task)
+    return (_worker_encoder().encode(buffer), taskStats)
+
+# The FrameEncoder of the job, made once per worker process so that the auto
+# serializer only probes the first buffer.
+def _worker_encoder():
+    encoder = _workerJob.get("encoder")
+    if encoder is None:
+        encoder = FrameEncoder(_workerJob["serializer"])
+        _workerJob["encoder"] = encoder
+    return encoder
+
+# Collect the results emitted by a reducer in a worker process in a list
+# that is returned to the main process.
+def _capture_output():
+    output = []
+    for engine in list(_liveEngines):
+        engine.result = output
+        engine.sink = None
+    return output
+
+# Reduce a partition, and fold the salted groups given with it. Returns the
+# folded groups after the output and statistics of the partition.
+def _run_reduce_task(task):
+    partition, saltedGroups = task
+    foldedGroups = _fold_salted_groups(saltedGroups)
+    output, taskStats = _reduce_task(partition)
+    return (output, taskStats, foldedGroups)
+
+# Fold every (key, values) group with the combiner. Without a combiner the
+# reducer is associative: the values of the (key, value) pairs it emits for
+# the group are the folded values.
+def _fold_salted_groups(groups):
+    combiner = _workerJob["combiner"]
+    foldedGroups = []
+    for key, values in groups:
+        if combiner is not None:
+            foldedGroups.append((key, combiner(key, values)))
+            continue
+        output = _capture_output()
+        _reduce_groups(_workerJob["reducer"], [(key, values)], JobStats(),
+                       output.extend)
+        foldedGroups.append((key, [value for outputKey, value in output]))
+    return foldedGroups
+
+def _run_merge_reduce_task(segments):
+    if _workerJob["streamValues"]:
+        return _reduce_task(_stream_segments(segments))
+    return _reduce_task(_merge_segments(segments))
+
+def _reduce_task(groups):
+    output = _capture_output()
+    taskStats = JobStats()
+    startWall, startCpu = _clock()
+    _reduce_groups(_workerJob["reducer"], groups, taskStats, output.extend,
+                   _workerJob["streamValues"])
+    endWall, endCpu = _clock()
+    taskStats.cpu["reduce"] = endCpu - startCpu
+    return (output, taskStats)
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Job server
+#
+# Starting python, importing this module (and Pillow) and starting the
+# worker processes takes longer than many small jobs. The job server does
+# this once and then runs the lab scripts submitted to it, one at a time:
+#
+#   MAPRED_AUTHKEY=secret python MapReduce.py serve [--address ADDRESS]
+#                                                   [--workers N]
+#   MAPRED_AUTHKEY=secret python MapReduce.py submit SQLJoin.py Users.csv
+#                                                    Posts.csv
+#   MAPRED_AUTHKEY=secret python MapReduce.py stop
+#
+# submit runs the script in the server as if it was run with
+# 'python SCRIPT ARGS' in the current directory, and prints its output and
+# exits with its exit status. The script is run again for every job, so its
+# globals start from their initial values, and execute() clears the
+# intermediate data of earlier jobs.
+#
+# Jobs with workers > 1 run on the worker processes of the server. A worker
+# loads the script of a job (without running its __main__ block) to find
+# the mapper and reducer, and is sent the data globals of the script with
+# the tasks of the job (see _job_context).
+#
+# The address is a Unix socket (a named pipe on Windows). The server runs
+# the scripts it is sent as the user running it, so it only accepts
+# connections that know the authentication key, as the cluster nodes do.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+def default_job_address():
+    if (sys.platform == "win32"):
+        return r"\\.\pipe\mapred-jobs"
+    return os.path.join(tempfile.gettempdir(),
+                        "mapred-jobs-%d.sock" % os.getuid())
+
+# The worker pool of the job server. None outside the job server.
+_serverPool = None
+
+class JobServer(object):
+    def __init__(self, address=None, workers=None, authkey=None):
+        self.address = address or default_job_address()
+        self.workers = workers or multiprocessing.cpu_count()
+        self.authkey = authkey or _environment_authkey()
+
+    def serve_forever(self):
+        global _serverPool
+        _remove_stale_socket(self.address, self.authkey)
+        listener = connection.Listener(self.address, authkey=self.authkey)
+        _serverPool = multiprocessing.Pool(self.workers)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (connection.AuthenticationError, EOFError, IOError):
+                    # A client without the key, or that went away.
+                    continue
+                try:
+                    message = conn.recv()
+                    if (message[0] == "stop"):
+                        conn.send(("exit", 0))
+                        break
+                    command, script, args, cwd = message
+                    conn.send(("exit", _run_script(conn, script, args, cwd)))
+                except (EOFError, IOError):
+                    # The client went away.
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            _serverPool.terminate()
+            _serverPool.join()
+            _serverPool = None
+            listener.close()
+
+# A Unix socket left behind by a server that did not exit cleanly. A server
+# with another key is running.
+def _remove_stale_socket(address, authkey):
+    if not os.path.exists(address):
+        return
+    try:
+        connection.Client(address, authkey=authkey).close()
+    except connection.AuthenticationError:
+        pass
+    except (IOError, EOFError):
+        os.remove(address)
+        return
+    raise IOError("A job server is already running at %s" % address)
+
+# Run a script as __main__, with its output sent to the client. Returns the
+# exit status of the script.
+def _run_script(conn, script, args, cwd):
+    saved = (sys.argv, sys.path[0], sys.stdout, sys.stderr,
+             sys.modules["__main__"])
+    savedCwd = os.getcwd()
+    stdout = _ConnectionStream(conn, "stdout")
+    stderr = _ConnectionStream(conn, "stderr")
+    module = types.ModuleType("__main__")
+    module.__file__ = script
+    try:
+        sys.argv = [script] + list(args)
+        sys.path[0] = os.path.dirname(script)
+        sys.stdout = stdout
+        sys.stderr = stderr
+        # Functions of the script are sent to the worker processes as
+        # references to the __main__ module.
+        sys.modules["__main__"] = module
+        os.chdir(cwd)
+        try:
+            exec compile(open(script).read(), script, "exec") in \
+                module.__dict__
+            status = 0
+        except SystemExit as exit:
+            status = exit.code
+            if not isinstance(status, (int, long, types.NoneType)):
+                stderr.write("%s\n" % status)
+                status = 1
+            status = status or 0
+        except Exception:
+            traceback.print_exc(file=stderr)
+            status = 1
+        stdout.flush()
+        stderr.flush()
+        return status
+    finally:
+        (sys.argv, sys.path[0], sys.stdout, sys.stderr,
+         sys.modules["__main__"]) = saved
+        os.chdir(savedCwd)
+
+# A file object for the output of a job that sends the output to the client
+# in messages of up to JOB_OUTPUT_BYTES bytes.
+class _ConnectionStream(object):
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        self.parts.append(data)
+        self.size += len(data)
+        if (self.size >= JOB_OUTPUT_BYTES):
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self.parts:
+            self.conn.send((self.name, "".join(self.parts)))
+            self.parts = []
+            self.size = 0
+
+# Stands in for a multiprocessing.Pool in execute() when the job runs in the
+# job server. Every task is sent with the job, and a worker sets the job up
+# when it gets the first task of a new job. The pool itself belongs to the
+# server: closing the job does not stop the workers, and tasks of a failed
+# job that are already queued still run.
+class _ServerPoolJob(object):
+    def __init__(self, pool, job, context):
+        self.pool = pool
+        mainModule = sys.modules["__main__"]
+        self.jobKey = (os.getpid(), id(self), time.time())
+        self.script = getattr(mainModule, "__file__", None)
+        self.cwd = os.getcwd()
+        self.jobData = cPickle.dumps((job, context), cPickle.HIGHEST_PROTOCOL)
+        self.workers = pool._processes
+
+    def imap(self, function, tasks):
+        return self.pool.imap(_run_server_task,
+                              ((function, self.jobKey, self.script, self.cwd,
+                                self.jobData, task) for task in tasks))
+
+    def apply_async(self, function, args):
+        task, = args
+        return self.pool.apply_async(_run_server_task,
+                                     ((function, self.jobKey, self.script,
+                                       self.cwd, self.jobData, task),))
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+# The job whose tasks a worker of the job server, or a worker node of a
+# cluster, is running.
+_serverJobKey = None
+
+# Loaded job scripts in a worker, by path. An entry is
+# (modification time, module).
+_serverScripts = {}
+
+def _run_server_task(serverTask):
+    function, jobKey, script, cwd, jobData, task = serverTask
+    _use_server_job(jobKey, script, cwd, jobData)
+    return function(task)
+
+def _use_server_job(jobKey, script, cwd, jobData):
+    global _serverJobKey
+    if (jobKey == _serverJobKey):
+        return
+    # The directory of the coordinator may not exist on a worker node.
+    if os.path.isdir(cwd):
+        os.chdir(cwd)
+    if script is not None:
+        sys.modules["__main__"] = _load_script(script)
+    job, context = cPickle.loads(jobData)
+    _init_worker(job, context)
+    _serverJobKey = jobKey
+
+# Load a job script in a worker without running its __main__ block. The
+# script is loaded again when it has changed.
+def _load_script(script):
+    mtime = os.path.getmtime(script)
+    if script in _serverScripts:
+        loadedMtime, module = _serverScripts[script]
+        if (loadedMtime == mtime):
+            return module
+    module = types.ModuleType("__mapred_job__")
+    module.__file__ = script
+    sys.path[0] = os.path.dirname(script)
+    exec compile(open(script).read(), script, "exec") in module.__dict__
+    _serverScripts[script] = (mtime, module)
+    return module
+
+# Run a script in the job server at 'address' and copy its output to stdout
+# and stderr. Returns the exit status of the script. The authentication key
+# defaults to the one in the MAPRED_AUTHKEY environment variable.
+def submit_job(script, args=(), address=None, authkey=None):
+    conn = _job_server_client(address, authkey)
+    try:
+        conn.send(("run", os.path.abspath(script), list(args), os.getcwd()))
+        while True:
+            message = conn.recv()
+            if (message[0] == "exit"):
+                return message[1]
+            stream = sys.stdout if message[0] == "stdout" else sys.stderr
+            stream.write(message[1])
+    finally:
+        sys.stdout.flush()
+        conn.close()
+
+def stop_job_server(address=None, authkey=None):
+    conn = _job_server_client(address, authkey)
+    try:
+        conn.send(("stop",))
+        conn.recv()
+    finally:
+        conn.close()
+
+def _job_server_client(address, authkey):
+    return connection.Client(address or default_job_address(),
+                             authkey=authkey or _environment_authkey())
+
+def _job_server_main(argv):
+    parser = argparse.ArgumentParser(prog="MapReduce.py")
+    parser.add_argument("--address", default=None,
+                        help="Address of the job server")
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help="Run the job server")
+    serve.add_argument("--workers", type=int, default=None,
+                       help="Number of worker processes")
+    submit = commands.add_parser("submit", help="Run a script in the server")
+    submit.add_argument("script")
+    submit.add_argument("args", nargs=argparse.REMAINDER)
+    commands.add_parser("stop", help="Stop the job server")
+    worker = commands.add_parser("worker", help="Run a cluster worker node")
+    worker.add_argument("listen", help="HOST:PORT to listen on")
+    options = parser.parse_args(argv)
+    if (options.command == "serve"):
+        JobServer(options.address, options.workers).serve_forever()
+    elif (options.command == "worker"):
+        ClusterWorker(options.listen).serve_forever()
+    elif (options.command == "submit"):
+        return submit_job(options.script, options.args, options.address)
+    else:
+        stop_job_server(options.address)
+    return 0
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Cluster
+#
+# A job runs on a cluster of worker nodes when execute() is given a Cluster,
+# or when the MAPRED_CLUSTER environment variable lists the nodes:
+#
+#   node1$ MAPRED_AUTHKEY=secret python MapReduce.py worker node1:7070
+#   node2$ MAPRED_AUTHKEY=secret python MapReduce.py worker node2:7070
+#   $ MAPRED_AUTHKEY=secret MAPRED_CLUSTER=node1:7070,node2:7070 \
+#         python SQLJoin.py Users.csv Posts.csv
+#
+# Several nodes can run on one machine (for ex: localhost:7070 and
+# localhost:7071) to use its cores or to test a job.
+#
+# Functions are sent by reference, as pickle does: a node loads the script
+# of the job from its path, without running its __main__ block, and gets
+# the data globals of the script with the job (see _job_context). The
+# scripts and the input files that the nodes read (uncompressed files of
+# splittable formats, and formats read in the worker) must be at the same
+# paths on every node, for ex: on a shared file system. The records of
+# other files are read by the coordinator and sent with the tasks. The addresses of the nodes must be
+# reachable from every node, as the nodes fetch partitions from each other,
+# and the nodes must hash keys alike (same Python version and word size) for
+# the default partitioner.
+#
+# Pickled messages can run code, so the nodes only accept connections that
+# know the authentication key.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class Cluster(object):
+    def __init__(self, addresses, authkey=None):
+        if isinstance(addresses, basestring):
+            addresses = addresses.split(",")
+        self.addresses = [_parse_address(address) for address in addresses]
+        self.authkey = authkey or _environment_authkey()
+
+    # The cluster in the MAPRED_CLUSTER environment variable, or None.
+    @classmethod
+    def from_environment(cls):
+        addresses = os.environ.get(CLUSTER_ENV)
+        if not addresses:
+            return None
+        return cls(addresses)
+
+    def connect(self, address):
+        return connection.Client(address, authkey=self.authkey)
+
+def _environment_authkey():
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        raise ValueError("The authentication key is not set (%s)" %
+                         AUTHKEY_ENV)
+    return authkey
+
+# Convert "host:port" to (host, port).
+def _parse_address(address):
+    if isinstance(address, tuple):
+        return address
+    host, port = address.strip().rsplit(":", 1)
+    return (host, int(port))
+
+# A job running on a cluster. Every node is sent one task at a time.
+class _ClusterJob(object):
+    def __init__(self, cluster, job, context, retries=0):
+        self.cluster = cluster
+        self.retries = retries
+        self.jobKey = (socket.gethostname(), os.getpid(), id(self),
+                       time.time())
+        self.script = getattr(sys.modules["__main__"], "__file__", None)
+        if self.script is not None:
+            self.script = os.path.abspath(self.script)
+        self.cwd = os.getcwd()
+        self.jobData = cPickle.dumps((job, context), cPickle.HIGHEST_PROTOCOL)
+        self.numPartitions = job["numPartitions"]
+        # Nodes holding the map output of every task, by task number.
+        self.taskNodes = {}
+
+    def _job_message(self, command):
+        return (command, self.jobKey, self.script, self.cwd, self.jobData)
+
+    def map(self, tasks, stats):
+        messages = (self._job_message("map") + (taskId, task)
+                    for taskId, task in enumerate(tasks))
+        for taskId, (address, taskStats) in enumerate(self._imap(messages)):
+            self.taskNodes[taskId] = address
+            stats.merge(taskStats)
+
+    # Generate the (output, taskStats) of every partition.
+    def reduce(self):
+        sources = {}
+        for taskId, address in self.taskNodes.items():
+            sources.setdefault(address, []).append(taskId)
+        messages = (self._job_message("reduce") + (partition, sources)
+                    for partition in range(self.numPartitions))
+        for address, result in self._imap(messages):
+            yield result
+
+    # Remove the map output of the job from the nodes.
+    def end(self):
+        for address in set(self.taskNodes.values()):
+            try:
+                conn = self.cluster.connect(address)
+                try:
+                    conn.send(("end", self.jobKey))
+                    conn.recv()
+                finally:
+                    conn.close()
+            except (IOError, EOFError):
+                pass
+
+    # Send the messages to the nodes, one at a time per node, and generate
+    # (address of the node, reply) in the order of the messages.
+    def _imap(self, messages):
+        messages = enumerate(messages)
+        messageLock = threading.Lock()
+        condition = threading.Condition()
+        replies = {}
+        errors = []
+        stopped = []
+
+        def run_node(address):
+            try:
+                conn = self.cluster.connect(address)
+                try:
+                    while not (errors or stopped):
+                        with messageLock:
+                            index, message = next(messages, (None, None))
+                        if index is None:
+                            return
+                        for attempt in range(self.retries + 1):
+                            conn.send(message)
+                            status, reply = conn.recv()
+                            if (status != "error"):
+                                break
+                        if (status == "error"):
+                            raise ClusterError("Task failed on %s:%d:\n%s" %
+                                               (address + (reply,)))
+                        with condition:
+                            replies[index] = (address, reply)
+                            condition.notify()
+                finally:
+                    conn.close()
+            except BaseException:
+                errors.append(sys.exc_info())
+            finally:
+                with condition:
+                    condition.notify()
+
+        threads = [threading.Thread(target=run_node, args=(address,))
+                   for address in self.cluster.addresses]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            index = 0
+            while True:
+                with condition:
+                    while (index not in replies and not errors and
+                           any(thread.is_alive() for thread in threads)):
+                        condition.wait(0.1)
+                    if index in replies:
+                        reply = replies.pop(index)
+                    elif errors:
+                        excType, excValue, excTraceback = errors[0]
+                        raise excType, excValue, excTraceback
+                    else:
+                        return
+                yield reply
+                index += 1
+        finally:
+            stopped.append(True)
+            for thread in threads:
+                thread.join()
+
+class ClusterError(Exception):
+    pass
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Task scheduler
+#
+# Stands in for the pool of a job with retries, a task timeout or
+# speculative execution. Tasks are started with apply_async, no more at a
+# time than there are workers, so a task starts running when it is started
+# and its running time can be measured. A task that raises an exception or
+# times out is started again, up to 'retries' times. A task that runs
+# SPECULATIVE_FACTOR times longer than the median task gets a second copy,
+# and the first copy to finish gives the result. Results are generated in
+# task order, as pool.imap does.
+#
+# A worker running a task that timed out, or a copy whose result is not
+# used, is not counted as free until that task finishes. At the end of a job
+# the copies whose results are not used are waited for, and their results
+# discarded: terminating a pool while a worker writes a large result to it
+# hangs. A hung worker cannot be stopped on its own, so the pool is
+# terminated when a run is still going after the task timeout.
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class _TaskScheduler(object):
+    def __init__(self, pool, workers, stats, retries=0, timeout=None,
+                 speculative=False):
+        self.pool = pool
+        self.workers = workers
+        self.stats = stats
+        self.retries = retries
+        self.timeout = timeout
+        self.speculative = speculative
+        # Task runs whose results are not used, that still hold a worker.
+        self.abandoned = []
+        # Seconds taken by the finished tasks.
+        self.durations = []
+
+    def imap(self, function, tasks):
+        tasks = iter(tasks)
+        pending = collections.deque()
+        moreTasks = True
+        while True:
+            while (moreTasks and len(pending) < self.workers * TASK_WINDOW and
+                   self._running(pending) < self.workers):
+                task = next(tasks, _NO_TASK)
+                if task is _NO_TASK:
+                    moreTasks = False
+                    break
+                pending.append(_Task(function, task))
+                self._start(pending[-1])
+            if not pending:
+                return
+            if not pending[0].done:
+                pending[0].runs[0][0].wait(TASK_POLL_SECONDS)
+            now = time.time()
+            for task in pending:
+                if not task.done:
+                    self._check(task, now, pending)
+            while (pending and pending[0].done):
+                yield pending.popleft().result
+
+    # Number of workers busy with task runs.
+    def _running(self, pending):
+        self.abandoned = [run for run in self.abandoned
+                          if not run[0].ready()]
+        return len(self.abandoned) + sum(len(task.runs) for task in pending)
+
+    def _start(self, task):
+        task.runs.append((self.pool.apply_async(task.function, (task.task,)),
+                          time.time()))
+
+    def _check(self, task, now, pending):
+        for run in list(task.runs):
+            result, start = run
+            if result.ready():
+                task.runs.remove(run)
+                try:
+                    task.result = result.get()
+                except Exception:
+                    self._failed(task, sys.exc_info())
+                    continue
+                task.done = True
+                self.durations.append(now - start)
+                self.abandoned.extend(task.runs)
+                task.runs = []
+                return
+            if (self.timeout is not None and now - start > self.timeout):
+                task.runs.remove(run)
+                self.abandoned.append(run)
+                self.stats.timedOutTasks += 1
+                try:
+                    raise TaskTimeoutError("Task timed out after %s seconds" %
+                                           self.timeout)
+                except TaskTimeoutError:
+                    self._failed(task, sys.exc_info())
+        if (self.speculative and len(task.runs) == 1 and
+            not task.speculated and
+            len(self.durations) >= SPECULATIVE_MIN_TASKS and
+            now - task.runs[0][1] > (SPECULATIVE_FACTOR *
+                                     _median(self.durations)) and
+            self._running(pending) < self.workers):
+            task.speculated = True
+            self.stats.speculativeTasks += 1
+            self._start(task)
+
+    # A run of a task failed. The task is started again, unless it has
+    # failed more than 'retries' times.
+    def _failed(self, task, excInfo):
+        if task.runs:
+            # Another copy of the task is still running.
+            return
+        task.failures += 1
+        if (task.failures > self.retries):
+            excType, excValue, excTraceback = excInfo
+            raise excType, excValue, excTraceback
+        self.stats.retriedTasks += 1
+        self._start(task)
+
+    def close(self):
+        for result, start in self.abandoned:
+            if self.timeout is None:
+                result.wait()
+            else:
+                result.wait(max(0, start + self.timeout - time.time()))
+        if any(not result.ready() for result, start in self.abandoned):
+            self.pool.terminate()
+        else:
+            self.pool.close()
+
+    def terminate(self):
+        self.pool.terminate()
+
+    def join(self):
+        self.pool.join()
+
+_NO_TASK = object()
+
+class _Task(object):
+    def __init__(self, function, task):
+        self.function = function
+        self.task = task
+        # (AsyncResult, start time) of the runs of the task.
+        self.runs = []
+        self.failures = 0
+        self.speculated = False
+        self.done = False
+        self.result = None
+
+def _median(values):
+    return sorted(values)[len(values) // 2]
+
+class TaskTimeoutError(Exception):
+    pass
+
+# A worker node of a cluster. Every connection is served by a thread of its
+# own, so that a node can send its map output to other nodes while it runs a
+# task. Tasks run one at a time.
+class ClusterWorker(object):
+    def __init__(self, address, authkey=None):
+        self.address = _parse_address(address)
+        self.authkey = authkey or _environment_authkey()
+        # The map output of every job: {jobKey: {taskId: [partition]}}
+        self.store = {}
+        self.storeLock = threading.Lock()
+        self.taskLock = threading.Lock()
+
+    def serve_forever(self):
+        listener = connection.Listener(self.address, authkey=self.authkey)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (connection.AuthenticationError, IOError, EOFError):
+                    continue
+                thread = threading.Thread(target=self._serve, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+
+    def _serve(self, conn):
+        try:
+            while True:
+                message = conn.recv()
+                try:
+                    reply = ("ok", self._handle(message))
+                except Exception:
+                    reply = ("error", traceback.format_exc())
+                conn.send(reply)
+        except (EOFError, IOError):
+            pass
+        finally:
+            conn.close()
+
+    def _handle(self, message):
+        command = message[0]
+        if (command == "fetch"):
+            return self._local_partitions(*message[1:])
+        if (command == "end"):
+            with self.storeLock:
+                self.store.pop(message[1], None)
+            return None
+        command, jobKey, script, cwd, jobData = message[:5]
+        if (command == "map"):
+            taskId, task = message[5:]
+            with self.taskLock:
+                _use_server_job(jobKey, script, cwd, jobData)
+                buffer, taskStats = _run_map_task(task)
+                encoder = _worker_encoder()
+                partitions = [encoder.encode(partition) for partition in
+                              _split_partitions(buffer,
+                                                _workerJob["numPartitions"],
+                                                _workerJob["partitioner"])]
+            with self.storeLock:
+                self.store.setdefault(jobKey, {})[taskId] = partitions
+            return taskStats
+        if (command == "reduce"):
+            partition, sources = message[5:]
+            buffers = []
+            for address, taskIds in sources.items():
+                if (address == self.address):
+                    buffers.extend(self._local_partitions(jobKey, partition,
+                                                          taskIds))
+                else:
+                    buffers.extend(self._fetch(address, jobKey, partition,
+                                               taskIds))
+            buffers.sort(key=lambda (taskId, frame): taskId)
+            with self.taskLock:
+                _use_server_job(jobKey, script, cwd, jobData)
+                return _reduce_task(_merge_partitions(
+                    [decode_frame(frame) for taskId, frame in
+                     buffers]).iteritems())
+        raise ValueError("Unknown command: %s" % command)
+
+    # (taskId, frame) of partition 'partition' of the map tasks taskIds. The
+    # partitions are kept as frames (see Serialization) until they are
+    # reduced.
+    def _local_partitions(self, jobKey, partition, taskIds):
+        with self.storeLock:
+            tasks = self.store.get(jobKey, {})
+            return [(taskId, tasks[taskId][partition])
+                    for taskId in taskIds if taskId in tasks]
+
+    def _fetch(self, address, jobKey, partition, taskIds):
+        conn = connection.Client(address, authkey=self.authkey)
+        try:
+            conn.send(("fetch", jobKey, partition, taskIds))
+            status, reply = conn.recv()
+            if (status == "error"):
+                raise ClusterError("Fetch from %s:%d failed:\n%s" %
+                                   (address + (reply,)))
+            return reply
+        finally:
+            conn.close()
+
+# Split a buffer of intermediate data into numPartitions buffers.
+def _split_partitions(buffer, numPartitions, partitioner):
+    partitions = [{} for i in range(numPartitions)]
+    for key, values in buffer.iteritems():
+        partitions[partitioner(key, numPartitions)][key] = values
+    return partitions
+
+# Merge buffers of intermediate data, in order, into a new buffer.
+def _merge_partitions(buffers):
+    merged = {}
+    for buffer in buffers:
+        for key, values in buffer.iteritems():
+            mergedValues = merged.get(key)
+            if mergedValues is None:
+                if isinstance(values, CompactValues):
+                    mergedValues = CompactValues()
+                else:
+                    mergedValues = []
+                merged[key] = mergedValues
+            mergedValues.extend(values)
+    return merged
+
+if __name__ == '__main__':
+    # Job scripts import MapReduce. The server runs in that module, and not
+    # in this copy of it that runs as __main__.
+    import MapReduce
+    sys.exit(MapReduce._job_server_main(sys.argv[1:]))